@@ -1,9 +1,9 @@
 from argparse import ArgumentParser
 from dataclasses import dataclass
-from datetime import datetime, timedelta, date
+from datetime import datetime, date
 from itertools import groupby
 import logging
-import os
+import numpy
 import re
 from typing import Tuple, List, Dict
 import pyperclip
@@ -12,6 +12,7 @@ from types import SimpleNamespace
 import xlwings
 
 from mb51 import Mb51, AnalysisMatch
+from lib.assignment import min_cost_assignment
 from lib.db import SndbConnection
 
 """
@@ -48,6 +49,17 @@ def trace(self, message, *args, **kw):
 
 logging.Logger.trace = trace
 
+# optimal matcher cost of each hour between analysis and MB51 timestamps,
+#   in area units (IN2), so area stays the main weighting
+TIME_WEIGHT = 0.01
+NS_PER_HOUR = 3600 * 10**9
+
+# time distance of forbidden pairs
+NEVER = numpy.iinfo(numpy.int64).max
+
+# matrix entries compared at once by the greedy matcher
+SCAN_BLOCK = 4096
+
 # configure logging
 logging.basicConfig(
     format="%(levelname)s: %(message)s",
@@ -122,13 +134,8 @@ class ParsedAnalysisRow:
         )
 
 
-@dataclass
-class NearestNeighborDistance:
-    area: float
-    timestamp: timedelta
-
-    def __lt__(self, other):
-        return self.timestamp < other.timestamp and self.area <= other.area
+def to_ns(timestamps) -> numpy.ndarray:
+    return numpy.array(timestamps, dtype="datetime64[ns]").astype(numpy.int64)
 
 
 @dataclass
@@ -142,7 +149,6 @@ class Neighborhood:
     matl: str
     analysis: Dict[int, ParsedAnalysisRow]
     mb51: List[AnalysisMatch]
-    matrix: Dict[int, List[NearestNeighborDistance]]
 
     def __init__(self, part, qty, matl):
         self.part = part
@@ -150,52 +156,84 @@ class Neighborhood:
         self.matl = matl
         self.analysis = dict()
         self.mb51 = list()
-        self.matrix = dict()
+
+        # built on first use, see `matrix`
+        self._ids = None
+        self._matrix = None
 
     def add_analysis(self, id: int, row: ParsedAnalysisRow):
         self.analysis[id] = row
-        self.matrix[id] = list()
+        self._matrix = None
 
     def add_mb51(self, row: AnalysisMatch):
         self.mb51.append(row)
-        for k, v in self.analysis.items():
-            timediff = row.timestamp - v.timestamp
-            if row.timestamp < v.timestamp:
-                timediff = timedelta.max
-
-            self.matrix[k].append(
-                NearestNeighborDistance(
-                    area=abs(row.area - v.area),
-                    timestamp=timediff,
-                )
+        self._matrix = None
+
+    @property
+    def matrix(self) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        (area, time, forbidden) distances, analysis rows x MB51 items
+
+        time is in ns. forbidden pairs (MB51 timestamp before the analysis row)
+        have their time set to NEVER
+        """
+
+        if self._matrix is None:
+            self._ids = list(self.analysis)
+
+            rows = list(self.analysis.values())
+            area = numpy.array([r.area for r in rows], dtype=numpy.float64)
+            time = to_ns([r.timestamp for r in rows])
+
+            mb51_area = numpy.array([r.area for r in self.mb51], dtype=numpy.float64)
+            mb51_time = to_ns([r.timestamp for r in self.mb51])
+
+            timediff = mb51_time[None, :] - time[:, None]
+            forbidden = timediff < 0
+
+            self._matrix = (
+                numpy.abs(mb51_area[None, :] - area[:, None]),
+                numpy.where(forbidden, NEVER, timediff),
+                forbidden,
             )
 
-    def get_min(self) -> Tuple[int, AnalysisMatch]:
-        # get minimum distance in matrix
-        min_key = None
-        min_dist = None
-        min_dist_index = None
-        for k, v in self.matrix.items():
-            for i, d in enumerate(v):
-                if not min_dist or d < min_dist:
-                    min_key = k
-                    min_dist = d
-                    min_dist_index = i
+        return self._matrix
 
-        if not min_key:
-            return None
+    @staticmethod
+    def beats(a, b) -> bool:
+        # distance `a` replaces `b` as the scan's minimum: earlier and no larger.
+        #   not a total order, so the result depends on the scan order
+        return a[1] < b[1] and a[0] <= b[0]
 
+    def _take(self, i, j) -> Tuple[int, AnalysisMatch]:
         # remove row and column of minimum distance
-        # del self.analysis[min_key]
-        del self.matrix[min_key]
-        mb51 = self.mb51.pop(min_dist_index)
-        for k, v in self.matrix.items():
-            v.pop(min_dist_index)
+        self._matrix = tuple(numpy.delete(numpy.delete(a, i, 0), j, 1) for a in self._matrix)
 
         # return analysis id, mb51 item
-        return min_key, mb51
+        return self._ids.pop(i), self.mb51.pop(j)
+
+    def get_min(self) -> Tuple[int, AnalysisMatch]:
+        # get minimum distance in matrix: first entry, replaced by every later
+        #   entry (rows, then MB51 items) that beats the current minimum
+        area, time, _ = self.matrix
+        if not area.size:
+            return None
+
+        min_at = None
+        min_dist = None
+        for i, row in enumerate(zip(area.tolist(), time.tolist())):
+            for j, d in enumerate(zip(*row)):
+                if not min_dist or self.beats(d, min_dist):
+                    min_at = (i, j)
+                    min_dist = d
+
+        return self._take(*min_at)
+
+    def scan_updates(self):
+        """
+        reference matcher: search the whole matrix for each match
+        """
 
-    def dump_updates(self):
         while 1:
             x = self.get_min()
             if x:
@@ -203,6 +241,106 @@ class Neighborhood:
             else:
                 return StopIteration
 
+    def dump_updates(self):
+        """
+        same pairing as `scan_updates`, with the scan done on arrays
+
+        each match starts from the first entry still in the matrix and hops
+        to the next entry that beats it, a block of entries at a time.
+        used rows and columns are then filtered out of the entries left
+
+        `beats` is transitive, so whatever beats a later minimum also beats
+        the current one: each block is narrowed down to the entries that beat
+        the current minimum. while the minimum keeps its area, it hops along
+        the entries that are earlier than every entry before them, so those
+        are found at once; only a drop in area needs another pass
+        """
+
+        area, time, _ = self.matrix
+        n, m = area.shape
+
+        # entries still in the matrix, in scan order
+        area = area.ravel()
+        time = time.ravel()
+        rows, cols = numpy.divmod(numpy.arange(n * m), m)
+        while area.size:
+            k = 0
+            for start in range(1, area.size, SCAN_BLOCK):
+                # positions in the matrix that beat the current minimum
+                block = start + numpy.flatnonzero(
+                    (time[start : start + SCAN_BLOCK] < time[k])
+                    & (area[start : start + SCAN_BLOCK] <= area[k])
+                )
+                while block.size:
+                    # entries earlier than every entry before them in the block
+                    t = time[block]
+                    records = numpy.flatnonzero(
+                        numpy.r_[True, t[1:] < numpy.minimum.accumulate(t)[:-1]]
+                    )
+
+                    # the first of them with a smaller area lowers the minimum's area,
+                    #   otherwise the last of them is the minimum for this block
+                    drops = records[area[block[records]] < area[k]]
+                    if not drops.size:
+                        k = block[records[-1]]
+                        break
+
+                    k = block[drops[0]]
+                    block = block[drops[0] + 1 :]
+                    block = block[(time[block] < time[k]) & (area[block] <= area[k])]
+
+            i, j = int(rows[k]), int(cols[k])
+            yield self._ids[i], self.mb51[j]
+
+            keep = (rows != i) & (cols != j)
+            area = area[keep]
+            time = time[keep]
+            rows = rows[keep]
+            cols = cols[keep]
+
+    def optimal_updates(self):
+        """
+        pairing with the lowest total cost over the whole neighborhood
+
+        pairs where the MB51 timestamp predates the analysis row are never made
+        """
+
+        area, time, forbidden = self.matrix
+        cost = area + TIME_WEIGHT * numpy.where(forbidden, 0, time) / NS_PER_HOUR
+
+        for i, j in min_cost_assignment(cost, forbidden):
+            yield self._ids[i], self.mb51[j]
+
+    def check_updates(self):
+        """
+        run `dump_updates` and the reference scan and log where their pairings differ
+
+        returns the pairing of `dump_updates`
+        """
+
+        updates = list(self.dump_updates())
+        expected = list(self.scan_updates())
+
+        for (id, order), (expected_id, expected_order) in zip(updates, expected):
+            if (id, order.order) != (expected_id, expected_order.order):
+                log.warning(
+                    "Matcher mismatch in %s: (%d) -> %d, expected (%d) -> %d",
+                    (self.part, self.qty, self.matl),
+                    id,
+                    order.order,
+                    expected_id,
+                    expected_order.order,
+                )
+        if len(updates) != len(expected):
+            log.warning(
+                "Matcher mismatch in %s: %d matches, expected %d",
+                (self.part, self.qty, self.matl),
+                len(updates),
+                len(expected),
+            )
+
+        return updates
+
 
 class WeeklyAnalysis:
     rows: Dict[int, ParsedAnalysisRow | AnalysisRowUpdate]
@@ -212,9 +350,12 @@ class WeeklyAnalysis:
     _monday: date
     _header: SimpleNamespace
 
-    def __init__(self, monday=None):
+    def __init__(self, monday=None, matcher="greedy", check_matcher=False, mb51_cache=True):
         self.rows = dict()
         self._monday = monday
+        self.matcher = matcher
+        self.check_matcher = check_matcher
+        self.mb51_cache = mb51_cache
         self._header = None
         self._wb = None
         self._sheet = None
@@ -250,10 +391,6 @@ class WeeklyAnalysis:
         return self._sheet
 
     def pull(self):
-        sqlfile = os.path.join(
-            os.path.dirname(__file__), "sql", "get_analysis_data.sql"
-        )
-
         # create sheet if it does not exist
         wb = self.workbook
         if self.monday not in wb.sheet_names:
@@ -261,7 +398,7 @@ class WeeklyAnalysis:
 
         # pull data if sheet is empty
         if self.sheet.range("A2").value is None:
-            data = SndbConnection().query_from_sql_file(sqlfile)
+            data = SndbConnection().query_from_sql_file("get_analysis_data")
             self.sheet.range("A2").value = [list(row) for row in data]
         else:
             print(
@@ -371,7 +508,7 @@ class WeeklyAnalysis:
             )
 
     def analyze(self):
-        self.mb51 = Mb51()
+        self.mb51 = Mb51(use_cache=self.mb51_cache)
 
         # easy matches
         for k, row in self.rows.items():
@@ -440,7 +577,14 @@ class WeeklyAnalysis:
                 log.debug("\t-> (%d), %s", k, x)
             for o in group.mb51:
                 log.debug("\t-| %s", 0)
-            for id, order in group.dump_updates():
+            match self.matcher:
+                case "optimal":
+                    updates = group.optimal_updates()
+                case _ if self.check_matcher:
+                    updates = group.check_updates()
+                case _:
+                    updates = group.dump_updates()
+            for id, order in updates:
                 if log.level <= logging.DEBUG:
                     a = self.rows[id]
                     from_ts = a.timestamp.strftime("%Y-%m-%d %H:%M:%S")
@@ -512,6 +656,22 @@ if __name__ == "__main__":
     parser.add_argument(
         "--monday", type=str, default=None, help="Monday date operate on"
     )
+    parser.add_argument(
+        "--matcher",
+        choices=("greedy", "optimal"),
+        default="greedy",
+        help="pair rows greedily (as before) or with the lowest total cost per neighborhood",
+    )
+    parser.add_argument(
+        "--check-matcher",
+        action="store_true",
+        help="compare the greedy matcher against its full-scan reference",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="re-parse mb51.xlsx even if it has not changed",
+    )
     parser.add_argument(
         "-v", "--verbose", action="count", default=3, help="make the script more chatty"
     )
@@ -526,6 +686,9 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
+    if args.check_matcher and args.matcher == "optimal":
+        parser.error("--check-matcher only applies to the greedy matcher")
+
     if args.silence:
         args.verbose = 0
 
@@ -547,7 +710,12 @@ if __name__ == "__main__":
     if args.pull:
         WeeklyAnalysis(monday=args.monday).pull()
     elif args.analyze:
-        WeeklyAnalysis(monday=args.monday).match()
+        WeeklyAnalysis(
+            monday=args.monday,
+            matcher=args.matcher,
+            check_matcher=args.check_matcher,
+            mb51_cache=not args.no_cache,
+        ).match()
     elif args.not_matched:
         WeeklyAnalysis(monday=args.monday).get_not_matched()
     else:
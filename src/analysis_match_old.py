@@ -320,10 +320,11 @@ def parse_mb51() -> dict[str, Mb51Item]:
                 orders[row.order] = ProductionOrder(row.matl, row.order, row.qty)
             case "201" | "221" if row.program is not None:
                 # issue to cost center
-                if type(row.program) in (int, float):
-                    row.program = str(int(row.program))
+                program = row.program
+                if type(program) in (int, float):
+                    program = str(int(program))
                 issue.append(
-                    IssueItem(row.matl, row.document, timestamp, row.program, area)
+                    IssueItem(row.matl, row.document, timestamp, program, area)
                 )
             case "261" if row.uom != "EA":
                 # issue to order
@@ -1,5 +1,4 @@
 import datetime as dt
-import os
 import sys
 import pyperclip
 import xlwings as xl
@@ -17,14 +16,12 @@ def main():
 
 
 def fill_sheet(wb):
-    sqlfile = os.path.join(os.path.dirname(__file__), "sql", "get_analysis_data.sql")
-
     sheet_name = monday()
     if sheet_name not in wb.sheet_names:
         wb.sheets["template"].copy(before=wb.sheets["Issues"], name=sheet_name)
 
     if wb.sheets[sheet_name].range("A2").value is None:
-        data = SndbConnection().query_from_sql_file(sqlfile)
+        data = SndbConnection().query_from_sql_file("get_analysis_data")
         wb.sheets[sheet_name].range("A2").value = [list(row) for row in data]
 
         get_mb51_query_data(wb)
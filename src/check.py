@@ -4,25 +4,26 @@ from collections import defaultdict
 from datetime import datetime
 from pprint import pprint
 from tabulate import tabulate, SEPARATING_LINE
-from tqdm import tqdm
 # import xlwings
 
+import numpy
 import os
 
-from lib.db import SndbConnection
+from lib.db import SndbConnection, POOL
+from lib.snapshot import SnapshotConnection
+from lib.names import sap_part_name, sn_part_name
 from lib.parsers import SheetParser
 
 cutoff = datetime(year=2023, month=1, day=1)
 reportable_variance = 1
+interval_hours = 4
 
-query = """
-DECLARE @LastIntervalHourTimestamp DATETIME
-DECLARE @intervalHours INT
-SELECT @intervalHours = 4
-SELECT @LastIntervalHourTimestamp = DATEADD(HOUR, DATEDIFF(HOUR, 0, GETDATE()) / @intervalHours * @intervalHours, 0)
+# read SigmaNest data from the local snapshot (see sync.py)
+use_snapshot = False
 
+query = """
 SELECT
-    REPLACE(PartName, '_', '-') AS Part,
+    PartName AS Part,
     part.ProgramName AS Program,
     QtyProgram,
     NestedArea,
@@ -34,8 +35,30 @@ FROM PartArchive AS part
 		on part.ArchivePacketID=program.ArchivePacketID
 WHERE stock.primecode = ?
 AND part.ArcDateTime >= ?
-AND part.ArcDateTime < @LastIntervalHourTimestamp
+AND part.ArcDateTime < ?
+AND program.TransType = 'SN102'
+"""
+
+# same as `query`, but for every material master loaded into #MaterialMasters
+bulk_query = """
+SELECT
+    mm.PrimeCode AS MaterialMaster,
+    PartName AS Part,
+    part.ProgramName AS Program,
+    QtyProgram,
+    NestedArea,
+    NestedArea * QtyProgram AS TotalNestedArea
+FROM #MaterialMasters AS mm
+    inner join StockArchive as stock
+        on mm.PrimeCode=stock.PrimeCode
+    inner join PartArchive AS part
+        on part.ArchivePacketID=stock.ArchivePacketID
+    inner join ProgArchive as program
+        on part.ArchivePacketID=program.ArchivePacketID
+WHERE part.ArcDateTime >= ?
+AND part.ArcDateTime < ?
 AND program.TransType = 'SN102'
+ORDER BY mm.PrimeCode
 """
 
 
@@ -46,8 +69,13 @@ def main():
     parser.add_argument("--consumption", action="store_true", help="Check consumption")
     parser.add_argument("--confirmation", action="store_true", help="Check confirmations")
     parser.add_argument("--mm", action="store_true", help="generate list of material masters")
+    parser.add_argument("--snapshot", action="store_true", help="read SigmaNest data from the local snapshot")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print connection pool stats when done")
     args = parser.parse_args()
 
+    global use_snapshot
+    use_snapshot = args.snapshot
+
     if args.orders:
         get_orders()
     
@@ -58,13 +86,13 @@ def main():
         compare_single()
 
     elif args.consumption:
-        compare_many()
+        compare_many(show_pool=args.verbose)
 
     elif args.confirmation:
         check_confirmations()
 
 
-def compare_many(mm=None, show_unmatched=False):
+def compare_many(mm=None, show_unmatched=False, show_pool=False):
     # print = pprint
     for f in os.scandir("temp/per_mm"):
         os.remove(f.path)
@@ -73,31 +101,13 @@ def compare_many(mm=None, show_unmatched=False):
     for row in parse_cohv():
         orders[row.order] = row.part
 
-    mm = None
-    table = [["Material", "Qty"]]
-    partnames = list()
+    # collect consumption for every material master,
+    #   so that SigmaNest can be queried for all of them at once
+    consumption = dict()
     for row in parse_mb51():
-        if row.material != mm:
-            # add new line to report
-            if mm is not None:
-                variance = calc_variance(mm, parts, issued)
-                total = sum([x[-1] for x in variance[1:]])
-                if total > reportable_variance:
-                    table.append([mm, total])
-
-                    for _, part, _ in variance[1:]:
-                        partnames.append(part)
-
-                    with open('temp/manyresults.txt', 'w') as f:
-                        f.write(tabulate(table, headers="firstrow"))
-                    with open(f'temp/per_mm/{mm.replace("/", "_")}.txt', 'w') as f:
-                        f.write(table_with_totals(variance))
-
-            # reset collections
-            parts = defaultdict(float)
-            issued = defaultdict(float)
-
-        mm = row.material
+        if row.material not in consumption:
+            consumption[row.material] = (defaultdict(float), defaultdict(float))
+        parts, issued = consumption[row.material]
 
         # row.qty is negative for a consumption
         match row.type:
@@ -116,7 +126,32 @@ def compare_many(mm=None, show_unmatched=False):
             case x if show_unmatched:
                 print(f"Unmatched {x} ({type(x)})")
 
+    table = [["Material", "Qty"]]
+    partnames = list()
+
+    def report(mm, variance):
+        total = sum([x[-1] for x in variance[1:]])
+        if total > reportable_variance:
+            table.append([mm, total])
+
+            for _, part, _ in variance[1:]:
+                partnames.append(part)
+
+            with open('temp/manyresults.txt', 'w') as f:
+                f.write(tabulate(table, headers="firstrow"))
+            with open(f'temp/per_mm/{mm.replace("/", "_")}.txt', 'w') as f:
+                f.write(table_with_totals(variance))
+
+    for mm, sn_data in get_sn_data_many(consumption.keys()):
+        report(mm, calc_variance(mm, *consumption.pop(mm), sn_data=sn_data))
+
+    # material masters with nothing burned in SigmaNest
+    for mm, (parts, issued) in consumption.items():
+        report(mm, calc_variance(mm, parts, issued, sn_data=dict()))
+
     print(tabulate(table, headers="firstrow"))
+    if show_pool:
+        print(POOL)
     with open('temp/parts.txt', 'w') as f:
         f.write("\n".join(sorted(set(partnames))))
     
@@ -177,22 +212,17 @@ def check_confirmations():
             case "PR":      # Planned Order
                 planned[line.part] += line.qty
 
+    burned = get_burned_qty(sn_part_name(k) for k in confirmations)
+
     underconsumption = list()
     table = [["Part", "Cnf", "Burned"]]
-    with SndbConnection() as db:
-        for k, v in tqdm(confirmations.items(), desc="checking confirmation balance"):
-            db.execute("""
-                       SELECT ISNULL(SUM(QtyProgram), 0) AS Qty
-                       FROM PartArchive
-                       WHERE PartName=? AND WoNumber != 'REMAKES'
-                       """, k.replace("-", "_", 1))
-
-            qty = db.fetchone().Qty
-            if qty > v:
-                if k in planned:
-                    tqdm.write(f"{k} underconfirmed, but there are planned orders")
-                underconsumption.append(k)
-                table.append([k, v, qty])
+    for k, v in confirmations.items():
+        qty = burned.get(sn_part_name(k).casefold(), 0)
+        if qty > v:
+            if k in planned:
+                print(f"{k} underconfirmed, but there are planned orders")
+            underconsumption.append(k)
+            table.append([k, v, qty])
 
     print(tabulate(table, headers="firstrow"))
     
@@ -200,17 +230,32 @@ def check_confirmations():
         f.write("\n".join(sorted(underconsumption)))
 
 
-def calc_variance(mm, parts, issued):
+def calc_variance(mm, parts, issued, sn_data=None):
+    """
+        `sn_data` is a dict of columns, as returned by DbConnection.fetch_columns
+    """
+
+    if sn_data is None:
+        sn_data = get_sn_data(mm)
+
     # since all consumptions are negative,
     #  we can counter this by using addition again
     variance = [["Program", "Part", "Qty"]]
-    for row in get_sn_data(mm):
-        if row.Part in parts:
-            parts[row.Part] += row.TotalNestedArea
-        elif row.Program in issued:
-            issued[row.Program] += row.TotalNestedArea
-        else:
-            variance.append((row.Program, row.Part, row.TotalNestedArea))
+    if sn_data:
+        part = numpy.array([sap_part_name(p) for p in sn_data["Part"]], dtype=object)
+        program = sn_data["Program"]
+        area = sn_data["TotalNestedArea"]
+
+        to_part = numpy.isin(part, list(parts))
+        to_program = ~to_part & numpy.isin(program, list(issued))
+
+        for k, total in sum_by(part[to_part], area[to_part]):
+            parts[k] += total
+        for k, total in sum_by(program[to_program], area[to_program]):
+            issued[k] += total
+
+        for i in numpy.flatnonzero(~(to_part | to_program)):
+            variance.append((program[i], part[i], float(area[i])))
 
     for part, qty in parts.items():
         if abs(qty) > reportable_variance:
@@ -222,6 +267,20 @@ def calc_variance(mm, parts, issued):
     return variance
 
 
+def sum_by(keys, values):
+    """
+        (key, total of values) for each distinct key
+    """
+
+    if not len(keys):
+        return []
+
+    unique, inverse = numpy.unique(keys, return_inverse=True)
+    totals = numpy.bincount(inverse.ravel(), weights=values, minlength=len(unique))
+
+    return zip(unique.tolist(), totals.tolist())
+
+
 def get_orders():
     with open('temp/orders.txt', 'w') as f:
         orders = set([row.order for row in parse_mb51() if row.order])
@@ -240,12 +299,98 @@ def parse_cohv():
     return SheetParser(wb='cohv.xlsx').parse_sheet(with_progress=True)
 
 
+def sndb():
+    if use_snapshot:
+        return SnapshotConnection()
+
+    return SndbConnection()
+
+
+def last_interval():
+    # start of the last `interval_hours` block, so a run only sees whole intervals
+    now = datetime.now()
+
+    return now.replace(hour=now.hour // interval_hours * interval_hours, minute=0, second=0, microsecond=0)
+
+
 def get_sn_data(mm):
-    with SndbConnection() as db:
-        db.cursor.execute(query, mm, cutoff.strftime('%Y-%m-%d'))
+    with sndb() as db:
+        db.cursor.execute(query, mm, cutoff, last_interval())
 
-        for row in db.cursor.fetchall():
-            yield row
+        return db.fetch_columns()
+
+
+def get_burned_qty(parts):
+    """
+        burned quantity for a set of SigmaNest part names in a single query
+
+        part names compare case-insensitively, so the result is keyed by
+        casefolded name. parts not burned are left out of the result
+    """
+
+    with sndb() as db:
+        db.temp_table("Parts", "PartName", parts)
+        db.cursor.execute("""
+            SELECT parts.PartName, SUM(QtyProgram) AS Qty
+            FROM #Parts AS parts
+                INNER JOIN PartArchive AS part
+                    ON parts.PartName=part.PartName
+            WHERE part.WoNumber != 'REMAKES'
+            GROUP BY parts.PartName
+        """)
+
+        return { row.PartName.casefold(): row.Qty for row in db.cursor.fetchall() }
+
+
+def get_sn_data_many(mms):
+    """
+        nested area for many material masters in a single round-trip
+
+        yields (material master, columns) grouped by PrimeCode, as their rows are read.
+        PrimeCode compares case-insensitively, so material masters differing only
+        in case each get the same columns
+    """
+
+    spellings = defaultdict(list)
+    for mm in mms:
+        spellings[mm.casefold()].append(mm)
+
+    with sndb() as db:
+        db.temp_table("MaterialMasters", "PrimeCode", [v[0] for v in spellings.values()])
+        db.cursor.execute(bulk_query, cutoff, last_interval())
+
+        for mm, group in group_runs(db.fetch_column_batches(), "MaterialMaster"):
+            for name in spellings[mm.casefold()]:
+                yield name, group
+
+
+def group_runs(batches, key):
+    """
+        (key, columns) for each run of rows with the same `key` column
+
+        a run is yielded as soon as the next one starts, so batches of rows
+        sorted by `key` are grouped as they are read
+    """
+
+    held = None
+    for batch in batches:
+        keys = batch.pop(key)
+
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+        ends = numpy.r_[starts[1:], len(keys)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            group = {k: v[start:end] for k, v in batch.items()}
+
+            # the first run of a batch may go on from the last batch
+            if held and held[0] == keys[start]:
+                group = {k: numpy.concatenate((held[1][k], v)) for k, v in group.items()}
+            elif held:
+                yield held
+
+            held = (keys[start], group)
+
+    if held:
+        yield held
 
 
 def table_with_totals(data, totals_index=[-1]):
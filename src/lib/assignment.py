@@ -0,0 +1,91 @@
+
+import numpy
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # NumPy solver below is used instead. it is fine for a few hundred rows,
+    #   but install scipy for neighborhoods with thousands of candidates
+    linear_sum_assignment = None
+
+
+def min_cost_assignment(cost, forbidden=None):
+    """
+        pairs (row, column) of a rectangular cost matrix (NumPy array)
+        with the lowest total cost
+
+        pairs where the boolean `forbidden` mask is set are never made. as many
+        rows as possible are paired, then the total cost is kept to a minimum.
+    """
+
+    cost = numpy.asarray(cost, dtype=numpy.float64)
+    if forbidden is None:
+        forbidden = numpy.zeros(cost.shape, dtype=bool)
+
+    if forbidden.all():
+        return list()
+
+    # a forbidden pair costs more than any full set of allowed pairs,
+    #   so one is only used where no allowed pair is left
+    big = (numpy.abs(cost[~forbidden]).max() + 1) * (min(cost.shape) + 1)
+    filled = numpy.where(forbidden, big, cost)
+
+    if linear_sum_assignment:
+        rows, cols = linear_sum_assignment(filled)
+        pairs = zip(rows.tolist(), cols.tolist())
+    elif filled.shape[0] <= filled.shape[1]:
+        pairs = _hungarian(filled)
+    else:
+        pairs = [(i, j) for j, i in _hungarian(filled.T)]
+
+    return sorted((i, j) for i, j in pairs if not forbidden[i, j])
+
+
+def _hungarian(cost):
+    # shortest augmenting path with potentials, O(n^2 m) for n <= m rows,
+    #   with each step over the columns done as array operations
+    n, m = cost.shape
+
+    u = numpy.zeros(n + 1)                      # row potentials
+    v = numpy.zeros(m + 1)                      # column potentials
+    p = numpy.zeros(m + 1, dtype=numpy.intp)    # row assigned to each column (1-based, 0 is none)
+    way = numpy.zeros(m + 1, dtype=numpy.intp)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = numpy.full(m + 1, numpy.inf)
+        used = numpy.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+
+            # columns 1..m, as views
+            free = ~used[1:]
+            col_minv = minv[1:]
+            col_way = way[1:]
+
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (cur < col_minv)
+            col_minv[better] = cur[better]
+            col_way[better] = j0
+
+            j1 = int(numpy.where(free, col_minv, numpy.inf).argmin()) + 1
+            delta = minv[j1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        # flip the augmenting path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return [(int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j]]
@@ -2,11 +2,24 @@
 from typing import Any
 import pyodbc
 
-from os import getenv, path
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from copy import copy
+from os import getenv
 from datetime import datetime
+from decimal import Decimal
 from string import Template
+from threading import Lock
+from time import monotonic
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from lib.part import Part
+from lib.queries import SQL
+from lib.stats import QUERY_STATS, TimedCursor
 
 SNDB_PRD = "HSSSNData"
 SNDB_DEV = "HIIWINBL5"
@@ -14,17 +27,151 @@ SNDB_DEV = "HIIWINBL5"
 CONN_STR_USER_AUTH = Template("DRIVER={$driver};SERVER=$server;UID=$user;PWD=$pwd;DATABASE=$db;")
 CONN_STR_WIN_AUTH = Template("DRIVER={$driver};SERVER=$server;Trusted_connection=yes;")
 
+# columns always fetched as floats in columnar mode,
+#   even if the driver reports them as something else
+NUMERIC_COLUMNS = ("Area", "QtyProgram", "NestedArea", "UsedArea", "TotalNestedArea")
+
+GET_BOM = "EXEC BOM.SAP.GetBOMData @Job=?, @Ship=?"
+
 if len(pyodbc.drivers()) > 0:
     DEFAULT_DRIVER = pyodbc.drivers()[0]
 else:
     raise NotImplementedError("No SQL drivers available")
 
+
+def casefold_unique(values):
+    """
+        first spelling of each value, ignoring case
+    """
+
+    unique = dict()
+    for v in values:
+        unique.setdefault(v.casefold(), v)
+
+    return list(unique.values())
+
+
+class ConnectionPool:
+    """
+        process-wide pool of live pyodbc connections
+
+        connections are keyed by their connection string, which covers
+        server, database and authentication. idle connections are
+        health-checked before reuse and recycled once they get too old.
+    """
+
+    def __init__(self, max_idle=4, max_age=900, check_after=30):
+        self.max_idle = max_idle        # idle connections kept per key
+        self.max_age = max_age          # seconds before a connection is recycled
+        self.check_after = check_after  # idle seconds before a health check
+
+        self._idle = defaultdict(list)
+        self._created = dict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.recycled = 0
+
+    def acquire(self, conn_str):
+        while True:
+            with self._lock:
+                if not self._idle[conn_str]:
+                    self.misses += 1
+                    break
+
+                cnxn, released = self._idle[conn_str].pop()
+
+            if self._is_usable(cnxn, released):
+                with self._lock:
+                    self.hits += 1
+
+                return cnxn
+
+            self._discard(cnxn)
+
+        cnxn = pyodbc.connect(conn_str)
+        with self._lock:
+            self._created[id(cnxn)] = monotonic()
+
+        return cnxn
+
+    def release(self, conn_str, cnxn):
+        try:
+            # drop any open transaction so the next user starts clean
+            cnxn.rollback()
+        except pyodbc.Error:
+            self._discard(cnxn)
+            return
+
+        with self._lock:
+            if len(self._idle[conn_str]) < self.max_idle:
+                self._idle[conn_str].append((cnxn, monotonic()))
+                return
+
+        self._discard(cnxn, recycled=False)
+
+    def close_all(self):
+        with self._lock:
+            idle = [cnxn for conns in self._idle.values() for cnxn, _ in conns]
+            self._idle.clear()
+
+        for cnxn in idle:
+            self._discard(cnxn, recycled=False)
+
+    def _is_usable(self, cnxn, released):
+        now = monotonic()
+        if now - self._created.get(id(cnxn), now) > self.max_age:
+            return False
+
+        if now - released < self.check_after:
+            return True
+
+        try:
+            cnxn.cursor().execute("SELECT 1").fetchone()
+        except pyodbc.Error:
+            return False
+
+        return True
+
+    def _discard(self, cnxn, recycled=True):
+        with self._lock:
+            self._created.pop(id(cnxn), None)
+            if recycled:
+                self.recycled += 1
+
+        try:
+            cnxn.close()
+        except pyodbc.Error:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                recycled=self.recycled,
+                idle=sum(len(v) for v in self._idle.values()),
+            )
+
+    def __repr__(self):
+        return "<ConnectionPool> {}".format(
+            ", ".join("{}={}".format(k, v) for k, v in self.stats().items())
+        )
+
+
+POOL = ConnectionPool()
+
+
 class DbConnection:
     """
         pyodbc connection wrapper for databases
     """
 
-    def __init__(self, use_win_auth=False, **kwargs):
+    # rows fetched per round-trip when streaming results
+    arraysize = 1000
+
+    def __init__(self, use_win_auth=False, pooled=True, **kwargs):
         if use_win_auth:
             self.CS_TEMP = CONN_STR_WIN_AUTH
         else:
@@ -33,6 +180,7 @@ class DbConnection:
         self.driver = DEFAULT_DRIVER
         self.__dict__.update(kwargs)
 
+        self._pool = POOL if pooled else None
         self._cnxn = None
         self._cur = None
 
@@ -40,11 +188,36 @@ class DbConnection:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self._cnxn is not None:
-            self._cnxn.close()
+        self.close()
+
+    @property
+    def conn_str(self):
+        return self.CS_TEMP.substitute(**self.__dict__)
 
     def _make_cnxn(self):
-        self._cnxn = pyodbc.connect(self.CS_TEMP.substitute(**self.__dict__))
+        if self._pool:
+            self._cnxn = self._pool.acquire(self.conn_str)
+        else:
+            self._cnxn = pyodbc.connect(self.conn_str)
+
+    def close(self):
+        """
+            close the cursor and hand the connection back to the pool
+        """
+
+        if self._cur is not None:
+            try:
+                self._cur.close()
+            except pyodbc.Error:
+                pass
+            self._cur = None
+
+        if self._cnxn is not None:
+            if self._pool:
+                self._pool.release(self.conn_str, self._cnxn)
+            else:
+                self._cnxn.close()
+            self._cnxn = None
 
     def __getattr__(self, name):
         """
@@ -68,47 +241,167 @@ class DbConnection:
 
         return self._cnxn
 
+    def _make_cursor(self):
+        return self.connection.cursor()
+
     @property
     def cursor(self):
         if not self._cur:
-            self._cur = self.connection.cursor()
+            self._cur = self._make_cursor()
+
+            if QUERY_STATS.enabled:
+                self._cur = TimedCursor(self._cur)
 
         return self._cur
 
     def execute_sql_file(self, file_path, *args):
-        with open(file_path, 'r') as sql_file:
-            sql = sql_file.read()
+        """
+            execute a query from `src/sql` by name, or any .sql file by path
+        """
 
-            self.cursor.execute(sql, *args)
+        self.cursor.execute(SQL[file_path], *args)
 
         return self
     
     def query_from_sql_file(self, file_path, *args):
-        assert path.exists(file_path), "SQL file `{}` does not exist".format(file_path)
+        return self.cursor.execute(SQL[file_path], *args)
+
+    def temp_table(self, name, column, values, sql_type="VARCHAR(50)"):
+        """
+            load a set of values into a single column temp table
+
+            the table lives for as long as the connection, so it is dropped
+            first in case a pooled connection still holds one from a prior use
+        """
 
-        with open(file_path, 'r') as sql_file:
-            sql = sql_file.read()
+        # tempdb may not share the database's collation. that collation is
+        #   case-insensitive, so values differing only in case are loaded once
+        if "CHAR" in sql_type.upper():
+            sql_type += " COLLATE DATABASE_DEFAULT"
+            values = casefold_unique(values)
+        else:
+            values = set(values)
+
+        table = "#{}".format(name)
+        self.cursor.execute("IF OBJECT_ID('tempdb..{0}') IS NOT NULL DROP TABLE {0}".format(table))
+        self.cursor.execute("CREATE TABLE {} ({} {} PRIMARY KEY)".format(table, column, sql_type))
+
+        values = [(v,) for v in values]
+        if values:
+            self.cursor.fast_executemany = True
+            self.cursor.executemany("INSERT INTO {} VALUES (?)".format(table), values)
+            self.cursor.fast_executemany = False
+
+        return table
 
-            return self.cursor.execute(sql, *args)
+    def collect_table_data(self, arraysize=None):
+        return list(self.stream_table_data(arraysize))
+
+    def stream_table_data(self, arraysize=None):
+        """
+            lazily yields the header followed by the rows of the current result
+
+            rows are read in batches of `arraysize` and only datetime columns
+            are checked for the active date sentinel
+        """
 
-    def collect_table_data(self):
         min_date = datetime(1900, 1, 1)
 
-        data = [None]
-        for row in self.cursor.fetchall():
-            data.append(row)
+        cursor = self.cursor
+        cursor.arraysize = arraysize or self.arraysize
+
+        rows = None
+        if cursor.description:
+            rows = cursor.fetchmany()
+
+        if not rows:
+            caller = self.__dict__.get("func", "-- no origin --")
+            yield ["values"]
+            yield ["nothing returned ({})".format(caller)]
+            return
+
+        yield [t[0] for t in cursor.description]
+        date_cols = [i for i, t in enumerate(cursor.description) if t[1] is datetime]
+
+        while rows:
+            for row in rows:
+                # replace active dates (1900-01-01 00:00:00 -> --)
+                if any(row[i] == min_date for i in date_cols):
+                    row = list(row)
+                    for i in date_cols:
+                        if row[i] == min_date:
+                            row[i] = "--"
+
+                yield row
+
+            rows = cursor.fetchmany()
+
+    def _column_types(self):
+        types = dict()
+        for name, type_code, *_ in self.cursor.description:
+            if name in NUMERIC_COLUMNS or type_code in (float, Decimal):
+                types[name] = numpy.float64
+            elif type_code is int:
+                types[name] = numpy.int64
+            else:
+                types[name] = object
 
-            # replace active dates (1900-01-01 00:00:00 -> --)
-            if min_date in data[-1]:
-                data[-1] = ["--" if x == min_date else x for x in data[-1]]
-        else:
-            try:
-                data[0] = [t[0] for t in row.cursor_description]
-            except UnboundLocalError:
-                caller = self.__dict__.get("func", "-- no origin --")
-                return [["values"], ["nothing returned ({})".format(caller)]]
+        return types
+
+    def fetch_columns(self, arraysize=None):
+        """
+            fetch the current result as a dict of NumPy column arrays
+
+            numeric columns are typed (NULL becomes NaN) so aggregations can be
+            vectorized, e.g. `db.fetch_columns()["TotalNestedArea"].sum()`
+        """
+
+        if numpy is None:
+            raise NotImplementedError("numpy is required for columnar fetch")
+
+        types = self._column_types()
+        columns = {name: list() for name in types}
+
+        for batch in iter(lambda: self.cursor.fetchmany(arraysize or self.arraysize), []):
+            for name, values in zip(columns, zip(*batch)):
+                columns[name].extend(values)
+
+        return to_arrays(types, columns)
+
+    def fetch_all(self, sql, *args):
+        self.cursor.execute(sql, *args)
+
+        return self.cursor.fetchall()
+
+    def fetch_column_batches(self, arraysize=None):
+        """
+            same as `fetch_columns`, but yields a dict of columns
+            for every `fetchmany` batch as it is read
+        """
+
+        if numpy is None:
+            raise NotImplementedError("numpy is required for columnar fetch")
+
+        types = self._column_types()
+        for batch in iter(lambda: self.cursor.fetchmany(arraysize or self.arraysize), []):
+            yield to_arrays(types, dict(zip(types, zip(*batch))))
+
+
+def to_arrays(types, columns):
+    # column values to NumPy arrays of their fetched type
+    result = dict()
+    for name, values in columns.items():
+        dtype = types[name]
+        if dtype is numpy.int64 and None in values:
+            dtype = numpy.float64
+
+        if dtype is numpy.float64:
+            values = [numpy.nan if v is None else v for v in values]
+
+        result[name] = numpy.array(values, dtype=dtype)
+
+    return result
 
-        return data
 
 class SndbConnection(DbConnection):
     """
@@ -143,26 +436,116 @@ class BomConnection(DbConnection):
         init_kwargs.update(kwargs)
         super().__init__(use_win_auth=True, **init_kwargs)
 
-    def get_bom(self, job, shipment, mark=None):
-        self.cursor.execute(
-            "EXEC BOM.SAP.GetBOMData @Job=?, @Ship=?",
-            job, shipment
-        )
+    def get_bom(self, job, shipment, mark=None, cached=True):
+        bom = BOM_CACHE.get(job, shipment) if cached else None
+
+        if bom is None:
+            self.cursor.execute(GET_BOM, job, shipment)
+
+            bom = BOM_CACHE.put(job, shipment, [Part(row) for row in self.cursor.fetchall()])
 
+        # callers get copies, since they (and Part.matl_grade) change parts in place
+        parts, by_mark = bom
         if mark:
-            index = None
-            mark = mark.casefold()
-            for row in self.cursor.fetchall():
-                index = index or [t[0] for t in row.cursor_description].index("Piecemark")
-                
-                if row[index].casefold() == mark:
-                    return Part(row)
-            else:
-                return None
+            part = by_mark.get(mark.casefold())
+            return copy(part) if part else None
         
         # else
-        return [Part(row) for row in self.cursor.fetchall()]
+        return [copy(part) for part in parts]
+
+
+class BomCache:
+    """
+        least recently used cache of BOMs by (job, shipment)
+
+        each BOM is kept as its parts and those parts indexed by casefolded piecemark
+    """
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+
+        self._boms = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, job, shipment):
+        with self._lock:
+            bom = self._boms.get((job, shipment))
+            if bom is not None:
+                self._boms.move_to_end((job, shipment))
+
+        return bom
+
+    def put(self, job, shipment, parts):
+        by_mark = dict()
+        for part in parts:
+            # first occurrence wins, same as a scan of the BOM would
+            by_mark.setdefault(part.mark.casefold(), part)
+
+        with self._lock:
+            self._boms[(job, shipment)] = (parts, by_mark)
+            self._boms.move_to_end((job, shipment))
+
+            while len(self._boms) > self.max_size:
+                self._boms.popitem(last=False)
+
+        return parts, by_mark
+
+    def clear(self):
+        with self._lock:
+            self._boms.clear()
+
+
+BOM_CACHE = BomCache()
 
 
 def bom(job, shipment, mark=None):
-    BomConnection().get_bom(job, shipment, mark)
+    with BomConnection() as db:
+        return db.get_bom(job, shipment, mark)
+
+
+def boms(job_shipments, max_workers=4):
+    """
+        BOMs for several (job, shipment) pairs, fetched concurrently
+
+        yields ((job, shipment), [Part, ...]) as each BOM is ready.
+        cached BOMs come first, without a query, and fetched ones are cached
+    """
+
+    missing = list()
+    for job_shipment in dict.fromkeys(job_shipments):
+        bom = BOM_CACHE.get(*job_shipment)
+        if bom is None:
+            missing.append(job_shipment)
+        else:
+            yield job_shipment, [copy(part) for part in bom[0]]
+
+    jobs = [(GET_BOM, job_shipment) for job_shipment in missing]
+    for i, rows in run_concurrently(jobs, connection=BomConnection, max_workers=max_workers):
+        parts, _ = BOM_CACHE.put(*missing[i], [Part(row) for row in rows])
+
+        yield missing[i], [copy(part) for part in parts]
+
+
+def run_concurrently(jobs, connection=SndbConnection, max_workers=4, **kwargs):
+    """
+        run independent queries on separate pooled connections
+
+        `jobs` is an iterable of (sql, params) and results are yielded as
+        (index of job, rows) in the order that the queries finish
+    """
+
+    def run(sql, params):
+        with connection(**kwargs) as db:
+            return db.fetch_all(sql, *params)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {
+            executor.submit(run, sql, params): i for i, (sql, params) in enumerate(jobs)
+        }
+
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # stop queued jobs if the caller stops early
+        executor.shutdown(cancel_futures=True)
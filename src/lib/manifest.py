@@ -0,0 +1,200 @@
+
+import sqlite3
+
+from locale import getpreferredencoding
+from multiprocessing import Pool
+from os import environ, makedirs, path
+
+from lib.names import part_name
+
+MANIFEST_DB = path.join(environ.get("LOCALAPPDATA", path.expanduser("~")), "cogi", "cnf_manifest.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path    TEXT PRIMARY KEY,
+    size    INTEGER,
+    mtime   INTEGER
+);
+CREATE TABLE IF NOT EXISTS lines (
+    path    TEXT,
+    offset  INTEGER,
+    line    TEXT
+);
+CREATE INDEX IF NOT EXISTS lines_path ON lines (path, offset);
+CREATE TABLE IF NOT EXISTS parts (
+    part    TEXT,
+    path    TEXT,
+    offset  INTEGER
+);
+CREATE INDEX IF NOT EXISTS parts_part ON parts (part);
+CREATE INDEX IF NOT EXISTS parts_path ON parts (path);
+"""
+
+# bump when the manifest layout changes
+SCHEMA_VERSION = 2
+
+
+def line_part(line):
+    # normalized part name of a confirmation line
+    fields = line.split("\t", 2)
+    if len(fields) < 2:
+        return None
+
+    return part_name(*fields[:2])
+
+
+def dir_key(dir_path):
+    return path.normcase(path.normpath(dir_path))
+
+
+def read_lines(file_path):
+    """
+        (byte offset, uppercased line) for every line in a file
+    """
+
+    encoding = getpreferredencoding(False)
+
+    result = list()
+    offset = 0
+    with open(file_path, "rb") as f:
+        for line in f:
+            # same newlines as reading the file in text mode
+            text = line.decode(encoding, errors="replace").replace("\r\n", "\n")
+            result.append((offset, text.upper()))
+            offset += len(line)
+
+    return result
+
+
+class CnfManifest:
+    """
+        local copy of Production_ files, keyed by (path, size, mtime)
+
+        archived confirmation files never change, so only files that are new
+        (or whose size or mtime changed) are read from the network share
+    """
+
+    def __init__(self, db_path=MANIFEST_DB):
+        makedirs(path.dirname(db_path), exist_ok=True)
+
+        self.db_path = db_path
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+        version, = self.db.execute("PRAGMA user_version").fetchone()
+        if version < SCHEMA_VERSION:
+            self.reindex()
+            self.db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+            self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db.close()
+
+    def refresh(self, files, dirs=None, workers=None, chunksize=8, progress=None):
+        """
+            bring the manifest up to date with `files`, an iterable of (path, size, mtime)
+            scanned from `dirs` (by default, the directories of `files`)
+
+            files the manifest knows of in other directories are left alone.
+            returns the list of files that were (re)read
+        """
+
+        known = {row[0]: tuple(row[1:]) for row in self.db.execute("SELECT path, size, mtime FROM files")}
+
+        seen = set()
+        changed = list()
+        for file_path, size, mtime in files:
+            seen.add(file_path)
+            if known.get(file_path) != (size, mtime):
+                changed.append((file_path, size, mtime))
+
+        if dirs is None:
+            dirs = {path.dirname(p) for p in seen}
+        scanned = {dir_key(d) for d in dirs}
+
+        # files moved or deleted from the scanned directories, and files to be re-read
+        removed = [p for p in known.keys() - seen if dir_key(path.dirname(p)) in scanned]
+        stale = [(p,) for p in removed] + [(p,) for p, _, _ in changed]
+        self.db.executemany("DELETE FROM lines WHERE path=?", stale)
+        self.db.executemany("DELETE FROM parts WHERE path=?", stale)
+        self.db.executemany("DELETE FROM files WHERE path=?", stale)
+
+        if changed:
+            with Pool(workers) as pool:
+                results = pool.imap(read_lines, [f[0] for f in changed], chunksize=chunksize)
+                for (file_path, size, mtime), lines in zip(changed, results):
+                    self.add(file_path, size, mtime, lines)
+
+                    if progress:
+                        progress.update()
+
+        self.db.commit()
+
+        return changed
+
+    def add(self, file_path, size, mtime, lines):
+        self.db.executemany(
+            "INSERT INTO lines (path, offset, line) VALUES (?, ?, ?)",
+            [(file_path, offset, line) for offset, line in lines]
+        )
+        self.db.executemany(
+            "INSERT INTO parts (part, path, offset) VALUES (?, ?, ?)",
+            [(line_part(line), file_path, offset) for offset, line in lines]
+        )
+        self.db.execute("INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)", (file_path, size, mtime))
+
+    def reindex(self):
+        """
+            rebuild the part index from the stored lines
+        """
+
+        lines = self.db.execute("SELECT path, offset, line FROM lines").fetchall()
+
+        self.db.execute("DELETE FROM parts")
+        self.db.executemany(
+            "INSERT INTO parts (part, path, offset) VALUES (?, ?, ?)",
+            [(line_part(line), p, offset) for p, offset, line in lines]
+        )
+
+    def locate(self, parts):
+        """
+            where each part was confirmed: {part: [(path, byte offset), ...]}
+        """
+
+        result = dict()
+        for part, file_path, offset in self._lookup(parts, "p.part, p.path, p.offset"):
+            result.setdefault(part, list()).append((file_path, offset))
+
+        return result
+
+    def lookup(self, parts):
+        """
+            (path, byte offset, part, row) for each line of `parts`,
+            reading only the matching lines
+        """
+
+        columns = "p.path, p.offset, p.part, l.line"
+        for file_path, offset, part, line in self._lookup(parts, columns, join_lines=True):
+            yield file_path, offset, part, line.split("\t")
+
+    def _lookup(self, parts, columns, join_lines=False):
+        self.db.execute("DROP TABLE IF EXISTS temp.wanted")
+        self.db.execute("CREATE TEMP TABLE wanted (part TEXT PRIMARY KEY)")
+        self.db.executemany("INSERT INTO temp.wanted VALUES (?)", [(p,) for p in set(parts)])
+
+        sql = "SELECT {} FROM temp.wanted AS w INNER JOIN parts AS p ON p.part=w.part".format(columns)
+        if join_lines:
+            sql += " INNER JOIN lines AS l ON l.path=p.path AND l.offset=p.offset"
+
+        return self.db.execute(sql + " ORDER BY p.path, p.offset")
+
+    def rows(self, file_path):
+        """
+            rows of a file, split the same way as CnfFileParser.file_worker
+        """
+
+        for line, in self.db.execute("SELECT line FROM lines WHERE path=? ORDER BY offset", (file_path,)):
+            yield line.split("\t")
@@ -0,0 +1,62 @@
+
+from functools import lru_cache
+from re import compile as regex
+
+SCAN_PART = regex(r"(\d{3})([a-zA-Z])-\w+-\w+-(\w+)")
+DATA_FILE_JOB = regex(r"S-(\d{7})")
+
+# (part, job) pairs repeat across thousands of confirmation files
+CACHE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def part_name(_part, _job):
+    scan_match = SCAN_PART.match(_part)
+    job_match = DATA_FILE_JOB.match(_job)
+    if not (scan_match and job_match):
+        return _part
+
+    job_end, structure, part = scan_match.groups()
+    job_without_structure = job_match.group(1)
+
+    # if _part == "252B-1B-X-M318A":
+    #     print("\nmatches:", scan_match.groups(), "|", job_match.groups())
+    #     print("scan match:", bool(scan_match and job_match))
+    #     print("endswith match:", job_without_structure.endswith(job_end))
+    #     print("partname:", "{}{}-{}".format(job_without_structure, structure, part))
+
+    if not job_without_structure.endswith(job_end):
+        return _part
+
+    return "{}{}-{}".format(job_without_structure, structure, part)
+
+
+def part_names(pairs):
+    """
+        normalize a column of (part, job) pairs, each distinct pair only once
+    """
+
+    pairs = list(pairs)
+    names = {pair: part_name(*pair) for pair in dict.fromkeys(pairs)}
+
+    return [names[pair] for pair in pairs]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def sn_part_name(part):
+    """
+        SAP part name -> SigmaNest part name (underscore after the job)
+    """
+
+    return part.replace("-", "_", 1)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def sap_part_name(part):
+    """
+        SigmaNest part name -> SAP part name
+
+        same as `REPLACE(PartName, '_', '-')` in SQL
+    """
+
+    return part.replace("_", "-")
@@ -1,12 +1,32 @@
 
-import xlwings
-
+try:
+    import xlwings
+except ImportError:
+    # no Excel on this host: SheetParser reads .xlsx files directly
+    xlwings = None
+
+import mmap
+
+from array import array
+from collections import defaultdict, namedtuple
+from functools import partial
+from locale import getpreferredencoding
 from multiprocessing import Pool
-from os import path, listdir, environ
-from re import compile as regex
+from operator import itemgetter
+from os import path, listdir, environ, scandir, fstat
+from re import compile as regex, MULTILINE
 from types import SimpleNamespace
 from tqdm import tqdm
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from lib.manifest import CnfManifest
+from lib.names import part_name, part_names, SCAN_PART, DATA_FILE_JOB
+from lib.xlsx import XlsxReader
+
 aliases = SimpleNamespace()
 aliases.matl = ("Material", "Material Number")
 aliases.material = aliases.matl
@@ -30,47 +50,68 @@ aliases.cost_center = ("Cost Center",)
 aliases.document = ("Material Document",)
 aliases.user = ("User Name",)
 
+# header text -> fields it resolves to
+alias_fields = defaultdict(list)
+for k, v in aliases.__dict__.items():
+    for alias in v:
+        alias_fields[alias].append(k)
+
+# rows read from Excel per round-trip when parsing a sheet
+CHUNK_SIZE = 10000
+
 BASE_SAP_DATA_FILES = r"\\hssieng\SNData\SimTrans\SAP Data Files"
 SAP_OUTBOX = r"\\hiifileserv1\sigmanestprd\Archive"
-SAP_EXPORTS = path.join(environ.get("USERPROFILE"), r"Documents\SAP\SAP GUI")
+# COGI_SAP_EXPORTS=<dir> for hosts that keep exports somewhere else
+SAP_EXPORTS = environ.get("COGI_SAP_EXPORTS") or path.join(
+    environ.get("USERPROFILE", path.expanduser("~")), "Documents", "SAP", "SAP GUI"
+)
 
-SCAN_PART = regex(r"(\d{3})([a-zA-Z])-\w+-\w+-(\w+)")
-DATA_FILE_JOB = regex(r"S-(\d{7})")
 
+# first (part) field of each line in a confirmation file
+LINE_PART = regex(rb"^([^\t\r\n]*)\t", MULTILINE)
+# byte-level versions of SCAN_PART and a normalized part name
+SCAN_PART_BYTES = regex(rb"(\d{3}[a-zA-Z])-\w+-\w+-(\w+)")
+NORMALIZED_PART = regex(r"\d{4}(\d{3}[a-zA-Z])-(\w+)")
 
-def data_file_folder(folder_name):
-    return path.join(BASE_SAP_DATA_FILES, folder_name)
+# parts wanted by CnfFileParser.filter_worker, set once per worker process
+_worker_parts = frozenset()
+_worker_keys = SimpleNamespace(names=frozenset(), scans=frozenset())
 
 
-def part_name(_part, _job):
-    scan_match = SCAN_PART.match(_part)
-    job_match = DATA_FILE_JOB.match(_job)
-    if not (scan_match and job_match):
-        return _part
+def _init_filter_worker(parts):
+    global _worker_parts, _worker_keys
+    _worker_parts = parts
 
-    job_end, structure, part = scan_match.groups()
-    job_without_structure = job_match.group(1)
+    # a line can only normalize to a wanted part if its part field is either
+    #   that part, or its scan form `{job[-3:]}{structure}-*-*-{mark}`
+    scans = set()
+    for part in parts:
+        match = NORMALIZED_PART.fullmatch(part)
+        if match:
+            scans.add(tuple(g.upper().encode() for g in match.groups()))
 
-    # if _part == "252B-1B-X-M318A":
-    #     print("\nmatches:", scan_match.groups(), "|", job_match.groups())
-    #     print("scan match:", bool(scan_match and job_match))
-    #     print("endswith match:", job_without_structure.endswith(job_end))
-    #     print("partname:", "{}{}-{}".format(job_without_structure, structure, part))
+    _worker_keys = SimpleNamespace(
+        names=frozenset(p.upper().encode() for p in parts),
+        scans=frozenset(scans),
+    )
 
-    if not job_without_structure.endswith(job_end):
-        return _part
 
-    return "{}{}-{}".format(job_without_structure, structure, part)
+def data_file_folder(folder_name):
+    return path.join(BASE_SAP_DATA_FILES, folder_name)
 
 
 class SheetParser:
 
-    def __init__(self, wb=None, sheet=None):
+    def __init__(self, wb=None, sheet=None, headless=None):
 
         self._header = None
         self._sheet = None
         self._wb = wb
 
+        # read the .xlsx file directly instead of through Excel
+        self.headless = xlwings is None if headless is None else headless
+        self._reader = None
+
         if sheet:
             self.set_sheet(sheet)
 
@@ -79,6 +120,11 @@ class SheetParser:
         if sheet is None:
             return
 
+        elif self.headless:
+            # sheet name or index, 'active' is the default for the reader
+            self._reader = None
+            self._sheet = None if sheet == 'active' else sheet
+
         elif sheet == 'active':
             self._sheet = xlwings.books.active.sheets.active
         
@@ -91,6 +137,20 @@ class SheetParser:
         else:
             raise TypeError("sheet must be an xlwings sheet, string or integer")
 
+    @property
+    def reader(self):
+        assert self.headless, "reader is only available in headless mode"
+        assert type(self._wb) is str, "headless mode needs a workbook name or path"
+
+        if self._reader is None:
+            wb = self._wb
+            if '.' not in path.basename(wb):
+                wb += ".xlsx"
+
+            self._reader = XlsxReader(path.join(SAP_EXPORTS, wb), self._sheet)
+
+        return self._reader
+
     @property
     def header(self):
 
@@ -146,7 +206,9 @@ class SheetParser:
 
         self._header = SimpleNamespace()
 
-        if row is None:
+        if row is None and self.headless:
+            row = self.reader.row(1)
+        elif row is None:
             row = self.sheet.range("A1").expand('right').value
 
         for i, item in enumerate(row):
@@ -156,29 +218,47 @@ class SheetParser:
             #       header.matl = i
             # `
             # just less code to maintain
-            for k, v in aliases.__dict__.items():
-                if item in v:
-                    setattr(self._header, k, i)
+            for k in alias_fields.get(item, ()):
+                setattr(self._header, k, i)
+
+        # compile the row type once per sheet,
+        #   so each row is built with C-level calls only
+        fields = self._header.__dict__
+        self._row_type = namedtuple("SheetRow", fields.keys())
+        self._make_row = partial(tuple.__new__, self._row_type)
+
+        match len(fields):
+            case 0:
+                self._getter = lambda row: ()
+            case 1:
+                i, = fields.values()
+                self._getter = lambda row: (row[i],)
+            case _:
+                self._getter = itemgetter(*fields.values())
 
         self._header_parsed = True
 
     def parse_row(self, row=None):
-        res = SimpleNamespace()
+        if self._header is None:
+            self.parse_header()
 
         if row is None:
             row = 2
-        if type(row) is int:
+        if type(row) is int and self.headless:
+            row = self.reader.row(row)
+            row.extend([None] * (self.max_col + 1 - len(row)))
+        elif type(row) is int:
             row = self.sheet.range((row, 1)).expand('right').value
 
-        for k, v in self.header.__dict__.items():
-            # same as res.matl = row[header.matl]
-            setattr(res, k, row[v])
-
-        return res
+        # same as res.matl = row[header.matl], for every header field
+        return self._make_row(self._getter(row))
 
-    def parse_sheet(self, sheet=None, with_progress=False, skip_if=lambda: False):
+    def parse_sheet(self, sheet=None, with_progress=False, skip_if=lambda _: False, chunk_size=CHUNK_SIZE):
         """
             convenience method to parse entire sheet
+
+            rows are read in windows of `chunk_size` rows,
+            or all at once if `chunk_size` is falsy
         """
 
         if sheet:
@@ -187,10 +267,21 @@ class SheetParser:
         if self.header is None:
             self.parse_header()
 
-        rng = self.data_rng.value
+        if self.headless:
+            rng = self._read_rows()
+            desc = path.basename(self.reader.file_path)
+            total = None
+        elif chunk_size:
+            rng = self._read_chunks(chunk_size)
+            desc = self.sheet
+            total = self.last_row - 1
+        else:
+            rng = self.data_rng.value
+            desc = self.sheet
+            total = len(rng)
 
         if with_progress:
-            rng = tqdm(rng, desc='Parsing sheet {}'.format(self.sheet), total=len(rng))
+            rng = tqdm(rng, desc='Parsing sheet {}'.format(desc), total=total)
 
         for row in rng:
             parsed = self.parse_row(row)
@@ -200,12 +291,48 @@ class SheetParser:
 
             yield parsed
 
+    def _read_chunks(self, chunk_size):
+        # same extent as `data_rng`, one window at a time
+        last_row = self.last_row
+        width = self.max_col + 1
+
+        for start in range(2, last_row + 1, chunk_size):
+            end = min(start + chunk_size - 1, last_row)
+            window = self.sheet.range((start, 1), (end, width)).options(ndim=2).value
+
+            yield from window
+
+            # drop the window before reading the next one
+            del window
+
+    def _read_rows(self):
+        # same extent as `data_rng`: up to the first blank material
+        width = self.max_col + 1
+        for row in self.reader.rows(start=2):
+            if len(row) <= self.header.matl or row[self.header.matl] is None:
+                return
+
+            row.extend([None] * (width - len(row)))
+            yield row
+
 class CnfFileParser:
 
-    def __init__(self, processed_only=False, dir=None):
+    def __init__(self, processed_only=False, dir=None, workers=None, chunksize=8, manifest=None, prefilter=True):
         self.ipart = SimpleNamespace(matl=0, qty=4, wbs=2, plant=11, job=1, program=12)
         self.imatl = SimpleNamespace(matl=6, qty=8, loc=10, wbs=7, plant=11)
 
+        # worker processes (default: cpu count) and files sent to a worker at a time
+        self.workers = workers
+        self.chunksize = chunksize
+
+        # only decode lines whose part field could match (see `candidate_lines`)
+        self.prefilter = prefilter
+
+        # local copy of already-read files (True for the default location)
+        if manifest is True:
+            manifest = CnfManifest()
+        self.manifest = manifest
+
         if dir is None:
             self.dirs = [
                 data_file_folder("processed"),
@@ -230,20 +357,103 @@ class CnfFileParser:
                 if f.startswith("Production_"):
                     yield path.join(d, f)
 
+    def scan(self):
+        """
+            (path, size, mtime) of each Production_ file, in the same order as `files`
+        """
+
+        for d in self.dirs:
+            entries = [e for e in scandir(d) if e.name.startswith("Production_")]
+            for e in sorted(entries, key=lambda e: e.name, reverse=True):
+                stat = e.stat()
+                yield e.path, stat.st_size, stat.st_mtime_ns
+
     def get_cnf_file_rows(self, parts):
+        if self.manifest:
+            return self.get_manifest_rows(parts)
+
         prod_data = list()
-        num_files = sum([len(listdir(x)) for x in self.dirs])
-        with tqdm(desc="Fetching Data", total=num_files) as pbar:
-            for processed_file in Pool().imap(self.file_worker, self.files):
+        files = list(self.files)
+
+        # workers only send back lines for `parts`
+        pool = Pool(self.workers, initializer=_init_filter_worker, initargs=(frozenset(parts),))
+        with pool, tqdm(desc="Fetching Data", total=len(files)) as pbar:
+            for lines in pool.imap(self.filter_worker, files, chunksize=self.chunksize):
                 pbar.update()
-                for line in processed_file:
-                    part = part_name(*line[self.ipart.matl:self.ipart.job+1])
-                    if part in parts:
-                        line[self.ipart.matl] = part    # overwrite part with non-scan part name
-                        prod_data.append(line)
+                prod_data.extend(lines)
+
+        return prod_data
+
+    def get_manifest_rows(self, parts):
+        files = list(self.scan())
+
+        with tqdm(desc="Updating manifest", total=len(files)) as pbar:
+            pbar.update(len(files) - len(self.manifest.refresh(
+                files, dirs=self.dirs, workers=self.workers, chunksize=self.chunksize, progress=pbar
+            )))
+
+        # only the indexed lines for `parts` are read, in the same order as a scan.
+        #   the manifest may also hold files from directories not scanned here
+        order = {file_path: i for i, (file_path, _, _) in enumerate(files)}
+        matches = [m for m in self.manifest.lookup(parts) if m[0] in order]
+        matches.sort(key=lambda m: (order[m[0]], m[1]))
+
+        prod_data = list()
+        for _, _, part, line in matches:
+            line[self.ipart.matl] = part    # overwrite part with non-scan part name
+            prod_data.append(line)
 
         return prod_data
 
+    def get_cnf_table(self, parts):
+        return CnfTable.from_lines(self.get_cnf_file_rows(parts), self.ipart, self.imatl)
+
+    def filter_worker(self, f):
+        if self.prefilter:
+            lines = self.candidate_lines(f)
+        else:
+            lines = self.file_worker(f)
+
+        names = part_names((line[self.ipart.matl], line[self.ipart.job]) for line in lines)
+
+        result = list()
+        for line, part in zip(lines, names):
+            if part in _worker_parts:
+                line[self.ipart.matl] = part    # overwrite part with non-scan part name
+                result.append(line)
+
+        return result
+
+    def candidate_lines(self, f):
+        """
+            memory-maps a file and only decodes and splits the lines whose
+            part field (the first column) could be one of the wanted parts
+
+            candidates still go through the exact `part_name` check
+        """
+
+        result = list()
+        with open(f, "rb") as prod_file:
+            if fstat(prod_file.fileno()).st_size == 0:
+                return result
+
+            with mmap.mmap(prod_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for match in LINE_PART.finditer(data):
+                    field = match.group(1).upper()
+                    if field not in _worker_keys.names:
+                        scan = SCAN_PART_BYTES.match(field)
+                        if not (scan and scan.groups() in _worker_keys.scans):
+                            continue
+
+                    end = data.find(b"\n", match.end())
+                    end = len(data) if end == -1 else end + 1
+
+                    # same newlines as reading the file in text mode
+                    line = data[match.start():end].decode(getpreferredencoding(False))
+                    result.append(line.replace("\r\n", "\n").upper().split("\t"))
+
+        return result
+
     def file_worker(self, f):
         result = list()
         with open(f, "r") as prod_file:
@@ -310,8 +520,8 @@ class ParsedCnfRow:
         return "<ParsedCnfRow> {}".format(self.ls())
 
     def ls(self, qty=None, wbs=None):
-        if len(wbs) == 5:
-            wbs = "D-{}-{}".format(self.job[2:], wbs)
+        if wbs and len(wbs) == 5:
+            wbs = "D-{}-{}".format(self.part_job[2:], wbs)
 
         return [
             #part
@@ -368,6 +578,235 @@ class ParsedCnfRow:
         self.matl_qty += other.matl_qty
 
 
+class CnfTable:
+    """
+        columnar store of confirmation rows
+
+        text columns are dictionary-encoded (each distinct value is stored once
+        and rows hold an integer code), quantities are kept in typed arrays.
+        rows are handed out as ParsedCnfRow objects on demand.
+    """
+
+    TEXT_COLUMNS = ("part_name", "part_job", "part_wbs", "matl_master", "matl_wbs", "matl_loc", "matl_plant", "program")
+
+    # same rows are merged by ParsedCnfRow.__add__
+    MERGE_KEY = ("part_name", "matl_master", "matl_wbs")
+
+    def __init__(self):
+        self.codes = {c: array("I") for c in self.TEXT_COLUMNS}
+        self.part_qty = array("q")
+        self.matl_qty = array("d")
+
+        self._values = {c: list() for c in self.TEXT_COLUMNS}   # code -> value
+        self._lookup = {c: dict() for c in self.TEXT_COLUMNS}   # value -> code
+
+    @classmethod
+    def from_rows(cls, rows):
+        table = cls()
+        for row in rows:
+            table.append(row)
+
+        return table
+
+    @classmethod
+    def from_lines(cls, lines, part_indices, matl_indices):
+        """
+            build a table straight from split confirmation file lines
+        """
+
+        table = cls()
+        for line in lines:
+            table._append(
+                part_name=line[part_indices.matl],
+                part_job=line[part_indices.job],
+                part_wbs=line[part_indices.wbs],
+                part_qty=int(line[part_indices.qty]),
+                matl_master=line[matl_indices.matl],
+                matl_wbs=line[matl_indices.wbs],
+                matl_qty=float(line[matl_indices.qty]),
+                matl_loc=line[matl_indices.loc],
+                matl_plant=line[matl_indices.plant],
+                program=line[part_indices.program],
+            )
+
+        return table
+
+    def __len__(self):
+        return len(self.part_qty)
+
+    def __getitem__(self, i):
+        return ParsedCnfRow([
+            self.value("part_name", i),
+            self.value("part_job", i),
+            self.value("part_wbs", i),
+            self.part_qty[i],
+            self.value("matl_master", i),
+            self.value("matl_wbs", i),
+            self.matl_qty[i],
+            self.value("matl_loc", i),
+            self.value("matl_plant", i),
+            self.value("program", i),
+        ])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "<CnfTable> {} rows".format(len(self))
+
+    def _encode(self, column, value):
+        lookup = self._lookup[column]
+        if value not in lookup:
+            lookup[value] = len(lookup)
+            self._values[column].append(value)
+
+        return lookup[value]
+
+    def _append(self, part_qty, matl_qty, **text):
+        for column in self.TEXT_COLUMNS:
+            self.codes[column].append(self._encode(column, text[column]))
+
+        self.part_qty.append(part_qty)
+        self.matl_qty.append(matl_qty)
+
+    def append(self, row):
+        self._append(**{c: getattr(row, c) for c in self.TEXT_COLUMNS}, part_qty=row.part_qty, matl_qty=row.matl_qty)
+
+    def value(self, column, i):
+        return self._values[column][self.codes[column][i]]
+
+    def column(self, name):
+        """
+            decoded values of a text column, or the array of a quantity column
+        """
+
+        if name in self.codes:
+            values = self._values[name]
+            return [values[code] for code in self.codes[name]]
+
+        return getattr(self, name)
+
+    def _array(self, name):
+        # NumPy view (no copy) of a text column's codes or a quantity column
+        if numpy is None:
+            raise NotImplementedError("numpy is required for CnfTable column operations")
+
+        data = self.codes[name] if name in self.codes else getattr(self, name)
+        if not data:
+            return numpy.zeros(0, dtype=data.typecode)
+
+        return numpy.frombuffer(data, dtype=data.typecode)
+
+    @classmethod
+    def _from_arrays(cls, values, codes, part_qty, matl_qty):
+        table = cls()
+        for c in cls.TEXT_COLUMNS:
+            table._values[c] = list(values[c])
+            table._lookup[c] = {v: i for i, v in enumerate(values[c])}
+            table.codes[c].frombytes(codes[c].astype(table.codes[c].typecode).tobytes())
+
+        table.part_qty.frombytes(part_qty.astype(table.part_qty.typecode).tobytes())
+        table.matl_qty.frombytes(matl_qty.astype(table.matl_qty.typecode).tobytes())
+
+        return table
+
+    @property
+    def matl_qty_per_ea(self):
+        return self._array("matl_qty") / self._array("part_qty")
+
+    def _groups(self, columns):
+        """
+            (first row of each group, group of each row)
+
+            groups are numbered in order of first appearance
+        """
+
+        if not len(self):
+            return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.intp)
+
+        codes = numpy.stack([self._array(c) for c in columns], axis=1)
+        _, first, inverse = numpy.unique(codes, axis=0, return_index=True, return_inverse=True)
+
+        order = numpy.argsort(first)
+        rank = numpy.empty_like(order)
+        rank[order] = numpy.arange(len(order))
+
+        return first[order], rank[inverse.ravel()]
+
+    def _key(self, columns, i):
+        return tuple(self.value(c, i) for c in columns)
+
+    def group_by(self, *columns):
+        """
+            row indices for each distinct combination of `columns`
+        """
+
+        first, group = self._groups(columns)
+
+        rows = numpy.argsort(group, kind="stable")
+        bounds = numpy.cumsum(numpy.bincount(group, minlength=len(first)))[:-1]
+
+        return {
+            self._key(columns, i): indices.tolist()
+            for i, indices in zip(first.tolist(), numpy.split(rows, bounds))
+        }
+
+    def sum_by(self, *columns):
+        """
+            (part qty, material qty) totals for each distinct combination of `columns`
+        """
+
+        first, group = self._groups(columns)
+        part_qty = numpy.bincount(group, weights=self._array("part_qty"), minlength=len(first))
+        matl_qty = numpy.bincount(group, weights=self._array("matl_qty"), minlength=len(first))
+
+        return {
+            self._key(columns, i): (int(p), m)
+            for i, p, m in zip(first.tolist(), part_qty.tolist(), matl_qty.tolist())
+        }
+
+    def merged(self):
+        """
+            new table where rows with the same part, material and wbs are added
+            together, the same as adding the ParsedCnfRows with `+`
+        """
+
+        first, group = self._groups(self.MERGE_KEY)
+
+        return self._from_arrays(
+            self._values,
+            {c: self._array(c)[first] for c in self.TEXT_COLUMNS},
+            numpy.bincount(group, weights=self._array("part_qty"), minlength=len(first)).round(),
+            numpy.bincount(group, weights=self._array("matl_qty"), minlength=len(first)),
+        )
+
+    def __add__(self, other):
+        values = dict()
+        codes = dict()
+        for c in self.TEXT_COLUMNS:
+            values[c] = list(self._values[c])
+            lookup = dict(self._lookup[c])
+
+            # other's codes -> codes in the combined dictionary
+            mapping = list()
+            for v in other._values[c]:
+                if v not in lookup:
+                    lookup[v] = len(values[c])
+                    values[c].append(v)
+                mapping.append(lookup[v])
+
+            mapping = numpy.array(mapping, dtype=numpy.int64)
+            codes[c] = numpy.concatenate([self._array(c), mapping[other._array(c)]])
+
+        return self._from_arrays(
+            values,
+            codes,
+            numpy.concatenate([self._array("part_qty"), other._array("part_qty")]),
+            numpy.concatenate([self._array("matl_qty"), other._array("matl_qty")]),
+        )
+
+
 class ParsedIssueRow:
 
     def __init__(self, row, part_indices=None, matl_indices=None):
@@ -406,8 +845,8 @@ class ParsedIssueRow:
         return "<ParsedCnfRow> {}".format(self.ls())
 
     def ls(self, qty=None, wbs=None):
-        if len(wbs) == 5:
-            wbs = "D-{}-{}".format(self.job[2:], wbs)
+        if wbs and len(wbs) == 5:
+            wbs = "D-{}-{}".format(self.user1[2:], wbs)
 
         return [
             #part
@@ -2,6 +2,7 @@
 import os
 
 SAP_SIGMANEST_PRD = r"\\hiifileserv1\sigmanestprd"
+SAP_OUTBOUND = r"\\hiifileserv1\sigmanestprd\Outbound"
 SAP_DATA_FILES = r"\\hssieng\SNData\SimTrans\SAP Data Files"
 SIGMANEST_WORKORDERS = r"\\hssieng\DATA\HS\SAP - Material Master_BOM\SigmaNest Work Orders"
 
@@ -0,0 +1,81 @@
+
+from os import path, scandir, stat
+from threading import Lock
+
+SQL_DIR = path.join(path.dirname(path.dirname(__file__)), "sql")
+
+
+class SqlRegistry:
+    """
+        named SQL statements from the `sql` directory
+
+        files are read once and only re-read when their mtime changes.
+        the same string object is handed back for every lookup, which lets
+        pyodbc reuse the statement it already prepared on a cursor
+        when the same SQL is executed again.
+    """
+
+    def __init__(self, sql_dir=SQL_DIR):
+        self.sql_dir = sql_dir
+
+        self._files = dict()    # name -> file path
+        self._cache = dict()    # file path -> (mtime, sql)
+        self._names = dict()    # sql -> file name
+        self._lock = Lock()
+
+        self.load_all()
+
+    def load_all(self):
+        for entry in scandir(self.sql_dir):
+            name, ext = path.splitext(entry.name)
+            if ext == ".sql":
+                self._files[name] = entry.path
+                self.get(entry.path)
+
+    @property
+    def names(self):
+        return sorted(self._files)
+
+    def path(self, name):
+        """
+            file path for a query name (with or without `.sql`) or a file path
+        """
+
+        key = name[:-len(".sql")] if name.endswith(".sql") else name
+
+        return self._files.get(key, name)
+
+    def get(self, name):
+        file_path = self.path(name)
+        assert path.exists(file_path), "SQL file `{}` does not exist".format(file_path)
+
+        mtime = stat(file_path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(file_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+        with open(file_path, 'r') as sql_file:
+            sql = sql_file.read()
+
+        with self._lock:
+            self._cache[file_path] = (mtime, sql)
+            self._names[sql] = path.basename(file_path)
+
+        return sql
+
+    def name_of(self, sql):
+        """
+            file name a statement was loaded from, if any
+        """
+
+        return self._names.get(sql)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return path.exists(self.path(name))
+
+
+SQL = SqlRegistry()
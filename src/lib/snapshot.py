@@ -0,0 +1,172 @@
+
+import sqlite3
+
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from os import environ, makedirs, path
+from re import compile as regex
+
+from lib.db import DbConnection, SndbConnection, casefold_unique
+
+SNAPSHOT_DB = path.join(environ.get("LOCALAPPDATA", path.expanduser("~")), "cogi", "sndb_snapshot.db")
+ARCHIVE_TABLES = ("PartArchive", "StockArchive", "ProgArchive", "PIPArchive")
+
+# rows archived in the last few minutes are left for the next sync,
+#   so that a program still being archived is not half-copied
+SETTLE_MINUTES = 5
+
+# SQL Server session temp tables (#Name) live in sqlite's temp schema
+TEMP_TABLE = regex(r"#(\w+)")
+
+
+def to_sqlite(value):
+    # timestamps are stored as sortable ISO strings and numerics as floats.
+    #   converted here rather than with sqlite3.register_adapter, which would
+    #   apply to every sqlite connection in the process
+    match value:
+        case datetime():
+            return value.isoformat(" ", timespec="microseconds")
+        case Decimal():
+            return float(value)
+
+    return value
+
+
+def adapt(params):
+    return tuple(to_sqlite(v) for v in params)
+
+
+def _row_factory(cursor, row, _types=dict()):
+    # pyodbc-like rows: accessible by index or column name
+    names = tuple(t[0] for t in cursor.description)
+    if names not in _types:
+        _types[names] = namedtuple("Row", names, rename=True)
+
+    return _types[names]._make(row)
+
+
+class SnapshotCursor:
+    """
+        sqlite cursor that accepts the pyodbc calling convention
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.arraysize = 1
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, *args):
+        # pyodbc accepts parameters unpacked or as a single sequence
+        if len(args) == 1 and type(args[0]) in (list, tuple):
+            args = args[0]
+
+        self._cursor.execute(TEMP_TABLE.sub(r"temp.\1", sql), adapt(args))
+
+        return self
+
+    def executemany(self, sql, params):
+        self._cursor.executemany(TEMP_TABLE.sub(r"temp.\1", sql), map(adapt, params))
+
+        return self
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self.arraysize)
+
+
+class SnapshotConnection(DbConnection):
+    """
+        read-only stand-in for SndbConnection backed by the local snapshot
+
+        only SigmaNest's archive tables are mirrored, so queries must stick to
+        those tables and to SQL that both SQL Server and sqlite understand
+    """
+
+    def __init__(self, db_path=SNAPSHOT_DB, **kwargs):
+        super().__init__(pooled=False, db_path=db_path, **kwargs)
+
+    def _make_cnxn(self):
+        assert path.exists(self.db_path), "Snapshot `{}` does not exist. Run a sync first".format(self.db_path)
+
+        self._cnxn = sqlite3.connect(self.db_path)
+        self._cnxn.row_factory = _row_factory
+
+    def _make_cursor(self):
+        return SnapshotCursor(self.connection.cursor())
+
+    def temp_table(self, name, column, values, sql_type="TEXT"):
+        # compare case-insensitively, like the SQL Server temp table.
+        #   sqlite takes the left column's collation, so joins name this column first
+        if sql_type.upper() == "TEXT":
+            sql_type += " COLLATE NOCASE"
+            values = casefold_unique(values)
+        else:
+            values = set(values)
+
+        table = "temp.{}".format(name)
+        self.cursor.execute("DROP TABLE IF EXISTS {}".format(table))
+        self.cursor.execute("CREATE TABLE {} ({} {} PRIMARY KEY)".format(table, column, sql_type))
+        self.cursor.executemany("INSERT INTO {} VALUES (?)".format(table), [(v,) for v in values])
+
+        return table
+
+
+def watermark(local, table):
+    """
+        newest ArcDateTime already in the snapshot for a table
+    """
+
+    try:
+        latest = local.execute("SELECT MAX(ArcDateTime) FROM {}".format(table)).fetchone()[0]
+    except sqlite3.OperationalError:
+        # table not synced yet
+        return None
+
+    return datetime.fromisoformat(latest) if latest else None
+
+
+def sync(db_path=SNAPSHOT_DB, tables=ARCHIVE_TABLES, dev=False, arraysize=10000, log=print):
+    """
+        copy archive rows newer than the snapshot's watermark into the snapshot
+
+        the archive tables have no key, so rows at the watermark itself are
+        deleted locally and pulled again, instead of risking copying them twice
+    """
+
+    makedirs(path.dirname(db_path), exist_ok=True)
+
+    with SndbConnection(dev=dev) as sndb, sqlite3.connect(db_path) as local:
+        for table in tables:
+            since = watermark(local, table)
+
+            sql = "SELECT * FROM {} WHERE ArcDateTime < DATEADD(MINUTE, ?, GETDATE())".format(table)
+            args = [-SETTLE_MINUTES]
+            if since:
+                # `since` was read from an ArcDateTime (DATETIME) value, so casting
+                #   it back rounds to the same 1/300s tick and the rows at the
+                #   watermark compare equal on the server
+                sql += " AND ArcDateTime >= CAST(? AS DATETIME)"
+                args.append(since)
+                local.execute("DELETE FROM {} WHERE ArcDateTime >= ?".format(table), adapt([since]))
+
+            sndb.cursor.execute(sql, *args)
+            columns = ", ".join('"{}"'.format(t[0]) for t in sndb.cursor.description)
+            params = ", ".join("?" * len(sndb.cursor.description))
+
+            local.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns))
+            local.execute("CREATE INDEX IF NOT EXISTS {0}_ArcDateTime ON {0} (ArcDateTime)".format(table))
+
+            insert = "INSERT INTO {} ({}) VALUES ({})".format(table, columns, params)
+
+            total = 0
+            for batch in iter(lambda: sndb.cursor.fetchmany(arraysize), []):
+                local.executemany(insert, [adapt(row) for row in batch])
+                total += len(batch)
+
+            local.commit()
+            log("{}: {} rows synced (since {})".format(table, total, since or "beginning"))
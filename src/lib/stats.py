@@ -0,0 +1,197 @@
+
+import atexit
+import json
+import sys
+
+from os import getenv, path
+from threading import Lock
+from time import perf_counter
+
+from lib.printer import print_to_source
+from lib.queries import SQL
+
+LIB_DIR = path.dirname(__file__)
+
+
+def entry_point():
+    """
+        `script:function` of the first caller outside of lib
+    """
+
+    frame = sys._getframe(1)
+    while frame and path.dirname(frame.f_code.co_filename) == LIB_DIR:
+        frame = frame.f_back
+
+    if frame is None:
+        return "-- no origin --"
+
+    return "{}:{}".format(path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+
+
+def query_label(sql):
+    name = SQL.name_of(sql)
+    if name:
+        return name
+
+    # start of inline SQL, collapsed onto one line
+    sql = " ".join(sql.split())
+
+    return sql if len(sql) <= 60 else sql[:57] + "..."
+
+
+class QueryRecord:
+
+    def __init__(self, query, entry):
+        self.query = query
+        self.entry = entry
+
+        self.count = 0
+        self.exec_time = 0.0
+        self.first_row_time = 0.0
+        self.fetch_time = 0.0
+        self.rows = 0
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class QueryStats:
+    """
+        execution time, time to first row, fetch time and row counts
+        per statement (or SQL file) and calling entry point
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = dict()
+
+        self._lock = Lock()
+
+    def enable(self, output="print"):
+        """
+            start recording and report at process exit
+
+            `output` is either "print" or the path of a JSON file to write
+        """
+
+        if not self.enabled:
+            atexit.register(self.report, output)
+
+        self.enabled = True
+
+    def record(self, sql):
+        key = (query_label(sql), entry_point())
+
+        with self._lock:
+            if key not in self.records:
+                self.records[key] = QueryRecord(*key)
+
+            self.records[key].count += 1
+
+        return self.records[key]
+
+    def table(self):
+        table = [["Query", "Entry point", "Count", "Exec (s)", "First row (s)", "Fetch (s)", "Rows"]]
+        records = sorted(self.records.values(), key=lambda r: r.exec_time + r.fetch_time, reverse=True)
+        for r in records:
+            table.append([r.query, r.entry, r.count, r.exec_time, r.first_row_time, r.fetch_time, r.rows])
+
+        return table
+
+    def report(self, output="print"):
+        if not self.records:
+            return
+
+        if output == "print":
+            print_to_source(self.table(), sumcols=("Count", "Exec (s)", "Fetch (s)", "Rows"))
+        else:
+            with open(output, 'w') as f:
+                json.dump([r.to_dict() for r in self.records.values()], f, indent=2)
+
+
+QUERY_STATS = QueryStats()
+
+# COGI_QUERY_STATS=print or COGI_QUERY_STATS=<file>.json
+if getenv("COGI_QUERY_STATS"):
+    QUERY_STATS.enable(getenv("COGI_QUERY_STATS"))
+
+
+class TimedCursor:
+    """
+        cursor wrapper that records each statement in QUERY_STATS
+    """
+
+    def __init__(self, cursor, stats=QUERY_STATS):
+        self.__dict__.update(_cursor=cursor, _stats=stats, _record=None, _started=None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # arraysize, fast_executemany, etc. belong to the wrapped cursor
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self._cursor.arraysize)
+            if not rows:
+                return
+
+            yield from rows
+
+    def execute(self, sql, *args):
+        record = self._stats.record(sql)
+
+        start = perf_counter()
+        self._cursor.execute(sql, *args)
+        record.exec_time += perf_counter() - start
+
+        self.__dict__.update(_record=record, _started=start)
+
+        return self
+
+    def executemany(self, sql, params):
+        record = self._stats.record(sql)
+
+        start = perf_counter()
+        self._cursor.executemany(sql, params)
+        record.exec_time += perf_counter() - start
+
+        self.__dict__.update(_record=None, _started=None)
+
+        return self
+
+    def _fetched(self, start, rows):
+        end = perf_counter()
+        record = self._record
+        if record is None:
+            return
+
+        record.fetch_time += end - start
+        record.rows += rows
+
+        # only the first fetch after execute counts towards time to first row
+        if self._started is not None and rows:
+            record.first_row_time += end - self._started
+            self.__dict__["_started"] = None
+
+    def fetchone(self):
+        start = perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(start, 0 if row is None else 1)
+
+        return row
+
+    def fetchmany(self, *args):
+        start = perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._fetched(start, len(rows))
+
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows))
+
+        return rows
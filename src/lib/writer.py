@@ -0,0 +1,162 @@
+
+import shutil
+
+from datetime import datetime
+from itertools import count
+from os import getpid, makedirs, path, remove, rename
+
+from lib.paths import SAP_OUTBOUND
+
+# lines per .ready file, so one bad line does not hold up a whole re-post
+ROWS_PER_FILE = 5000
+# bytes buffered before each write to disk
+BUFFER_SIZE = 1 << 20
+
+# writers started by this process, so two started in the same second get different names
+_writer_ids = count()
+
+
+class ReadyFileWriter:
+    """
+        streams confirmation lines into Production_*.ready files
+
+        lines go to a `.tmp` file that is renamed to `.ready` once it is full
+        (or the writer is closed), so a half-written file is never picked up
+    """
+
+    def __init__(self, out_dir=".", rows_per_file=ROWS_PER_FILE, buffer_size=BUFFER_SIZE):
+        makedirs(out_dir, exist_ok=True)
+
+        self.out_dir = out_dir
+        self.rows_per_file = rows_per_file
+        self.buffer_size = buffer_size
+
+        self.files = list()     # finished .ready files
+        self.rows = 0
+
+        # timestamp, process and writer make names unique across runs and processes
+        self._prefix = "Production_{}_{}_{}".format(
+            datetime.now().strftime("%Y%m%d%H%M%S"), getpid(), next(_writer_ids)
+        )
+        self._seq = 0
+        self._file = None
+        self._tmp_path = None
+        self._file_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _open(self):
+        while True:
+            name = "{}_{:03d}.ready".format(self._prefix, self._seq)
+            self._seq += 1
+
+            ready_path = path.join(self.out_dir, name)
+            if not (path.exists(ready_path) or path.exists(ready_path + ".tmp")):
+                break
+
+        self._tmp_path = ready_path + ".tmp"
+        # "x" so a file that appeared since the check is never truncated
+        self._file = open(self._tmp_path, "x", buffering=self.buffer_size)
+        self._file_rows = 0
+
+    def _finalize(self):
+        self._file.close()
+
+        ready_path = self._tmp_path[:-len(".tmp")]
+        # rename replaces an existing file on POSIX, so check first
+        if path.exists(ready_path):
+            raise FileExistsError("`{}` already exists".format(ready_path))
+        rename(self._tmp_path, ready_path)
+        self.files.append(ready_path)
+
+        self._file = None
+        self._tmp_path = None
+
+    def write(self, row, qty=None):
+        """
+            write `qty` of a ParsedCnfRow (all of it if None)
+
+            same as `row.output(qty)`, so the row's quantities are reduced
+        """
+
+        if self._file is None:
+            self._open()
+
+        self._file.write(row.output(qty))
+        self._file_rows += 1
+        self.rows += 1
+
+        if self._file_rows >= self.rows_per_file:
+            self._finalize()
+
+    def write_all(self, splits):
+        """
+            write an iterable of (row, qty) splits
+        """
+
+        for row, qty in splits:
+            self.write(row, qty)
+
+        return self
+
+    def close(self):
+        """
+            finalize the current file and return all .ready files written
+        """
+
+        if self._file is not None:
+            self._finalize()
+
+        return self.files
+
+    def discard(self):
+        # leave finished files alone, but never promote a partial one
+        if self._file is not None:
+            self._file.close()
+            remove(self._tmp_path)
+
+            self._file = None
+            self._tmp_path = None
+
+
+def write_ready_files(splits, out_dir=".", rows_per_file=ROWS_PER_FILE):
+    """
+        write (row, qty) splits to .ready files and return their paths
+    """
+
+    with ReadyFileWriter(out_dir, rows_per_file) as writer:
+        writer.write_all(splits)
+
+    return writer.files
+
+
+def move_ready_files(files, dest=SAP_OUTBOUND):
+    """
+        move .ready files to the Outbound share
+
+        each file is copied under a temporary name and renamed on the share,
+        so SAP never sees a partially copied file. a file that is already on
+        the share is never overwritten
+    """
+
+    moved = list()
+    for file_path in files:
+        target = path.join(dest, path.basename(file_path))
+        if path.exists(target):
+            raise FileExistsError("`{}` is already in {}".format(path.basename(file_path), dest))
+
+        shutil.copyfile(file_path, target + ".tmp")
+        # rename (unlike replace) fails on Windows if the target appeared meanwhile
+        rename(target + ".tmp", target)
+        remove(file_path)
+
+        moved.append(target)
+
+    return moved
@@ -0,0 +1,201 @@
+
+from datetime import datetime, timedelta
+from posixpath import join, normpath
+from re import compile as regex
+from xml.etree.ElementTree import iterparse, parse
+from zipfile import ZipFile
+
+NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+# built-in number formats
+DATE_FORMATS = {14, 15, 16, 17, 22, 27, 30, 36, 50, 57}
+TIME_FORMATS = {18, 19, 20, 21, 45, 46, 47}
+
+CELL_REF = regex(r"([A-Z]+)(\d+)")
+# strip quoted text, escapes and colors/conditions (but not elapsed time like [h])
+#   before looking for date tokens
+FORMAT_NOISE = regex(r'"[^"]*"|\\.|\[(?![hms]+\])[^\]]*\]')
+
+
+def column_index(letters):
+    index = 0
+    for c in letters:
+        index = index * 26 + ord(c) - ord('A') + 1
+
+    return index - 1
+
+
+def format_kind(code):
+    """
+        'date', 'time' or None for a custom number format code
+    """
+
+    code = FORMAT_NOISE.sub("", code.split(";")[0]).lower()
+    if any(c in code for c in "dy"):
+        return "date"
+    if any(c in code for c in "hs"):
+        return "time"
+    # `m` alone is ambiguous (month/minute), but a format with only `m` is a month
+    if "m" in code and "general" not in code:
+        return "date"
+
+    return None
+
+
+class XlsxReader:
+    """
+        read-only, streaming reader for .xlsx files that does not need Excel
+
+        values come back the way xlwings returns them:
+            numbers as floats, dates as datetimes, times as day fractions,
+            empty cells as None
+    """
+
+    def __init__(self, file_path, sheet=None):
+        self.file_path = file_path
+        self.sheet = sheet
+
+        self._strings = None
+        self._styles = None
+
+    def _sheet_path(self, zf):
+        workbook = parse(zf.open("xl/workbook.xml")).getroot()
+        rels = parse(zf.open("xl/_rels/workbook.xml.rels")).getroot()
+
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(PKG_REL_NS + "Relationship")}
+        sheets = [(s.get("name"), s.get(REL_NS + "id")) for s in workbook.iter(NS + "sheet")]
+
+        match self.sheet:
+            case str():
+                rel_id = dict(sheets)[self.sheet]
+            case int():
+                rel_id = sheets[self.sheet][1]
+            case _:
+                # active sheet, same as xlwings' `sheets.active`
+                view = workbook.find("{0}bookViews/{0}workbookView".format(NS))
+                active = int(view.get("activeTab", 0)) if view is not None else 0
+                rel_id = sheets[active][1]
+
+        target = targets[rel_id]
+        if target.startswith("/"):
+            return target[1:]
+
+        return normpath(join("xl", target))
+
+    def _load_strings(self, zf):
+        self._strings = list()
+        if "xl/sharedStrings.xml" not in zf.namelist():
+            return
+
+        for _, elem in iterparse(zf.open("xl/sharedStrings.xml")):
+            if elem.tag == NS + "si":
+                self._strings.append("".join(t.text or "" for t in elem.iter(NS + "t")))
+                elem.clear()
+
+    def _load_styles(self, zf):
+        # cell style index -> 'date', 'time' or None
+        self._styles = list()
+        if "xl/styles.xml" not in zf.namelist():
+            return
+
+        styles = parse(zf.open("xl/styles.xml")).getroot()
+
+        custom = dict()
+        for fmt in styles.iter(NS + "numFmt"):
+            custom[int(fmt.get("numFmtId"))] = format_kind(fmt.get("formatCode"))
+
+        cell_xfs = styles.find(NS + "cellXfs")
+        for xf in (cell_xfs if cell_xfs is not None else []):
+            fmt_id = int(xf.get("numFmtId", 0))
+            if fmt_id in custom:
+                self._styles.append(custom[fmt_id])
+            elif fmt_id in DATE_FORMATS:
+                self._styles.append("date")
+            elif fmt_id in TIME_FORMATS:
+                self._styles.append("time")
+            else:
+                self._styles.append(None)
+
+    def _value(self, cell):
+        kind = cell.get("t", "n")
+
+        if kind == "inlineStr":
+            return "".join(t.text or "" for t in cell.iter(NS + "t"))
+
+        v = cell.find(NS + "v")
+        if v is None or v.text is None:
+            return None
+
+        match kind:
+            case "s":
+                return self._strings[int(v.text)]
+            case "str":
+                return v.text
+            case "b":
+                return v.text == "1"
+            case "e":
+                return None
+
+        value = float(v.text)
+        style = int(cell.get("s", 0))
+        if style < len(self._styles):
+            match self._styles[style]:
+                case "date":
+                    return EXCEL_EPOCH + timedelta(days=value)
+                case "time":
+                    return value % 1
+
+        return value
+
+    def rows(self, start=1):
+        """
+            yields each row (1-based, from `start`) as a list of values
+
+            rows missing from the file are yielded as empty lists
+        """
+
+        with ZipFile(self.file_path) as zf:
+            if self._strings is None:
+                self._load_strings(zf)
+            if self._styles is None:
+                self._load_styles(zf)
+
+            sheet_data = None
+            row_num = 0
+            for event, elem in iterparse(zf.open(self._sheet_path(zf)), events=("start", "end")):
+                if event == "start":
+                    if elem.tag == NS + "sheetData":
+                        sheet_data = elem
+                    continue
+
+                if elem.tag != NS + "row":
+                    continue
+
+                prev, row_num = row_num, int(elem.get("r", row_num + 1))
+                for skipped in range(max(prev + 1, start), row_num):
+                    yield []
+
+                if row_num >= start:
+                    row = list()
+                    for cell in elem.iter(NS + "c"):
+                        ref = CELL_REF.match(cell.get("r", ""))
+                        col = column_index(ref.group(1)) if ref else len(row)
+                        row.extend([None] * (col - len(row)))
+                        row.append(self._value(cell))
+
+                    yield row
+
+                # free each row once it is read
+                elem.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(elem)
+
+    def row(self, row_num):
+        for row in self.rows(start=row_num):
+            return row
+
+        return []
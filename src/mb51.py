@@ -1,11 +1,21 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, Iterator
+from hashlib import sha1
+from os import path, stat
+import pickle
+from typing import Dict, Iterator, Tuple
 from tqdm import tqdm
 from types import SimpleNamespace
 
 import xlwings
 
+from lib.parsers import SAP_EXPORTS
+
+MB51_EXPORT = path.join(SAP_EXPORTS, "mb51.xlsx")
+
+# bump when the parsed rows change shape, so old caches are not loaded
+CACHE_VERSION = 1
+
 
 @dataclass
 class ConsumptionItem:
@@ -104,28 +114,96 @@ class Mb51ParsedRow:
 
 class Mb51:
     rows: Dict[int, ProductionOrder | IssueItem]
+    # (part, qty, consumption matl) -> {order: ProductionOrder}
+    _neighborhoods: Dict[Tuple[str, int, str], Dict[int, ProductionOrder]]
+    # issue reference id -> {doc: IssueItem}
+    _issues: Dict[int, Dict[int, IssueItem]]
     _wb: xlwings.Book
     _sheet: xlwings.Sheet
 
-    def __init__(self) -> None:
+    def __init__(self, file_path=MB51_EXPORT, use_cache=True) -> None:
+        self.file_path = file_path
         self.rows = dict()
+        self._neighborhoods = dict()
+        self._issues = dict()
         self._wb = None
         self._sheet = None
 
-        self.parse_sheet()
+        if not (use_cache and self.load_cache()):
+            self.parse_sheet()
+            if use_cache:
+                self.save_cache()
+
+        self.index()
 
     def __del__(self):
-        self.workbook.close()
+        # Excel is only opened when the cache could not be used
+        if self._wb:
+            self._wb.close()
 
     @property
     def workbook(self):
         if not self._wb:
-            self._wb = xlwings.Book(
-                r"C:\Users\PMiller1\Documents\SAP\SAP GUI\mb51.xlsx"
-            )
+            self._wb = xlwings.Book(self.file_path)
 
         return self._wb
 
+    @property
+    def cache_path(self):
+        return path.splitext(self.file_path)[0] + ".cache"
+
+    def fingerprint(self, known=None) -> Tuple[int, int, str]:
+        """
+        (size, mtime, sha1) of the export
+
+        the file is only hashed if its size or mtime differ from `known`
+        """
+
+        st = stat(self.file_path)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known
+
+        with open(self.file_path, "rb") as f:
+            digest = sha1(f.read()).hexdigest()
+
+        return (st.st_size, st.st_mtime_ns, digest)
+
+    def load_cache(self) -> bool:
+        """
+        load rows parsed from this same export on an earlier run
+        """
+
+        if not path.exists(self.cache_path):
+            return False
+
+        try:
+            with open(self.cache_path, "rb") as f:
+                version, known, rows = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return False
+
+        if version != CACHE_VERSION:
+            return False
+
+        fingerprint = self.fingerprint(known)
+        # same size and content hash, even if the file was touched or copied
+        if (fingerprint[0], fingerprint[2]) != (known[0], known[2]):
+            return False
+
+        self.rows = rows
+        if fingerprint != known:
+            self.save_cache(fingerprint)
+
+        return True
+
+    def save_cache(self, fingerprint=None):
+        with open(self.cache_path, "wb") as f:
+            pickle.dump(
+                (CACHE_VERSION, fingerprint or self.fingerprint(), self.rows),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+
     @property
     def sheet(self):
         if not self._sheet:
@@ -205,11 +283,37 @@ class Mb51:
                 case _:
                     pass
 
+    def index(self):
+        """
+        build the lookups used by `get_neighborhood` and `get_by_id`
+
+        each index keeps the order of `rows`, so lookups return rows
+        in the same order a scan of `rows` would
+        """
+
+        self._neighborhoods = dict()
+        self._issues = dict()
+        for key, row in self.rows.items():
+            match row:
+                case ProductionOrder() if row.consumption:
+                    by_key = self._neighborhoods.setdefault(self._key(row), dict())
+                    by_key[key] = row
+                case IssueItem():
+                    self._issues.setdefault(row.id, dict())[key] = row
+
+    @staticmethod
+    def _key(row: ProductionOrder) -> Tuple[str, int, str]:
+        return (row.part, row.qty, row.consumption.matl)
+
     def remove(self, order_or_doc):
-        try:
-            del self.rows[order_or_doc]
-        except KeyError:
-            pass
+        row = self.rows.pop(order_or_doc, None)
+
+        # keep the indexes in step with rows
+        match row:
+            case ProductionOrder() if row.consumption:
+                self._neighborhoods.get(self._key(row), dict()).pop(order_or_doc, None)
+            case IssueItem():
+                self._issues.get(row.id, dict()).pop(order_or_doc, None)
 
     def get_area(self, order_or_doc) -> float | None:
         match self.rows[order_or_doc]:
@@ -221,9 +325,8 @@ class Mb51:
                 return None
 
     def get_by_id(self, id: int) -> IssueItem | None:
-        for row in self.rows.values():
-            if isinstance(row, IssueItem) and row.id == id:
-                return row
+        for row in self._issues.get(id, dict()).values():
+            return row
 
         return None
 
@@ -234,9 +337,7 @@ class Mb51:
     def get_neighborhood(
         self, part: str, qty: int, matl: str
     ) -> Iterator[AnalysisMatch]:
-        for row in self.rows.values():
-            match row:
-                case (
-                    ProductionOrder()
-                ) if row.part == part and row.qty == qty and row.consumption and row.consumption.matl == matl:
-                    yield row.to_match()
+        # copied, so rows can be removed while the neighborhood is consumed
+        rows = list(self._neighborhoods.get((part, qty, matl), dict()).values())
+        for row in rows:
+            yield row.to_match()
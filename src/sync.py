@@ -0,0 +1,17 @@
+from argparse import ArgumentParser
+
+from lib.snapshot import sync, ARCHIVE_TABLES, SNAPSHOT_DB
+
+
+def main():
+    parser = ArgumentParser(description="Mirror SigmaNest archive tables into a local snapshot")
+    parser.add_argument("--db", action="store", default=SNAPSHOT_DB, help="snapshot file")
+    parser.add_argument("--dev", action="store_true", help="sync from the development database")
+    parser.add_argument("tables", nargs="*", default=ARCHIVE_TABLES, help="tables to sync")
+    args = parser.parse_args()
+
+    sync(db_path=args.db, tables=args.tables, dev=args.dev)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,48 @@
 
 import re
-import shutil
 
 from argparse import ArgumentParser
+from os import path
 from pprint import pprint
 
+from lib.db import boms
+from lib.parsers import CnfFileParser
+from lib.printer import print_to_source
+from lib.writer import move_ready_files, write_ready_files
+
+# `make mv` picks up .ready files from here
+READY_DIR = path.dirname(path.abspath(__file__))
+
 def main():
     parser = ArgumentParser()
-    parser.add_argument("--move", action="store", help="Move Production_*.ready files")
+    parser.add_argument("--move", nargs="+", help="Move Production_*.ready files")
     parser.add_argument("--jobs", action="store_true", help="output jobs from `temp/parts.txt`")
+    parser.add_argument("--where", nargs="+", help="list the confirmation files that mention these parts")
+    parser.add_argument("--confirmed", nargs="+", help="total confirmed qty and material for these parts")
+    parser.add_argument("--repost", nargs="+", help="write the net confirmations of these parts to Production_*.ready files")
+    parser.add_argument("--outbound", action="store_true", help="move the files written by --repost to the Outbound share")
+    parser.add_argument("--bom", nargs="+", help="list the BOMs of these JOB-SHIPMENTs (e.g. 1200110A-1)")
     args = parser.parse_args()
 
     if args.move:
-        shutil.move(args.move, r"\\hiifileserv1\sigmanestprd\Outbound")
+        for moved in move_ready_files(args.move):
+            print(moved)
     
     if args.jobs:
         get_jobs()
 
+    if args.where:
+        where_confirmed(args.where)
+
+    if args.confirmed:
+        confirmed_totals(args.confirmed)
+
+    if args.repost:
+        repost(args.repost, outbound=args.outbound)
+
+    if args.bom:
+        print_boms(args.bom)
+
 
 def get_jobs():
     with open("temp/parts.txt") as f:
@@ -27,5 +53,57 @@ def get_jobs():
                 print(job + "*")
 
 
+def where_confirmed(parts):
+    parser = CnfFileParser(manifest=True)
+    parser.manifest.refresh(parser.scan(), dirs=parser.dirs)
+
+    located = parser.manifest.locate([p.upper() for p in parts])
+    for part in parts:
+        print(part)
+        for file_path, offset in located.get(part.upper(), []):
+            print("\t{} @ {}".format(file_path, offset))
+
+
+def confirmed_totals(parts):
+    table = CnfFileParser(manifest=True).get_cnf_table([p.upper() for p in parts])
+
+    results = [["Part", "Material", "WBS", "Qty", "Material Qty"]]
+    for row in table.merged():
+        results.append([row.part_name, row.matl_master, row.matl_wbs, row.part_qty, row.matl_qty])
+
+    print_to_source(results, sumcols=("Qty", "Material Qty"))
+
+
+def repost(parts, outbound=False):
+    table = CnfFileParser(manifest=True).get_cnf_table([p.upper() for p in parts])
+
+    # one line per part, material and WBS, for its net confirmed qty
+    splits = ((row, None) for row in table.merged() if row.part_qty > 0)
+    files = write_ready_files(splits, out_dir=READY_DIR)
+
+    if outbound:
+        files = move_ready_files(files)
+
+    for file_path in files:
+        print(file_path)
+
+
+def print_boms(job_shipments):
+    pairs = list()
+    for job_shipment in job_shipments:
+        assert "-" in job_shipment, "`{}` is not JOB-SHIPMENT".format(job_shipment)
+        pairs.append(tuple(job_shipment.upper().split("-", 1)))
+
+    # BOMs are fetched at the same time, so they finish in any order
+    fetched = dict(boms(pairs))
+
+    results = [["Job", "Shipment", "Piecemark", "Qty", "Size", "Material", "Item"]]
+    for job, shipment in dict.fromkeys(pairs):
+        for part in fetched[(job, shipment)]:
+            results.append([job, shipment, part.mark, part.qty, part.size, part.matl_grade, part.item])
+
+    print_to_source(results, sumcols=("Qty",))
+
+
 if __name__ == "__main__":
     main()